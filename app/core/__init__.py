@@ -1,15 +1,34 @@
+from app.core.cache import DocumentCache
 from app.core.db.firestore_db import FirestoreManager
+from app.core.db.async_firestore_db import AsyncFirestoreManager
 from app.core.google_docs import GoogleDocsManager
 from app.core.storage import StorageManager
 from app.core.firebase import FirebaseManager
 from app.core.upstash_redis import UnifiedRedisManager
+from app.model.model import TableConfig
 from app.settings import ENV
 
-__all__ = ["db", "storage", "firebase", "docs", "redis"]
+__all__ = ["db", "async_db", "storage", "firebase", "docs", "redis"]
 
-db = FirestoreManager(ENV.FIRE_STORE_DB_NAME, ENV.GOOGLE_CREDENTIAL_PATH)
+# Shared by db and async_db so a write through either invalidates both
+doc_cache = DocumentCache(
+    ttls={
+        TableConfig.USER.value: ENV.FIRESTORE_CACHE_USER_TTL,
+        TableConfig.AGENT.value: ENV.FIRESTORE_CACHE_USER_TTL,
+    },
+    max_entries=ENV.FIRESTORE_CACHE_MAX_ENTRIES,
+)
 
-storage = StorageManager(credential_path=ENV.GOOGLE_CREDENTIAL_PATH)
+db = FirestoreManager(ENV.FIRE_STORE_DB_NAME, ENV.GOOGLE_CREDENTIAL_PATH, cache=doc_cache)
+
+async_db = AsyncFirestoreManager(
+    ENV.FIRE_STORE_DB_NAME, ENV.GOOGLE_CREDENTIAL_PATH, cache=doc_cache)
+
+storage = StorageManager(
+    credential_path=ENV.GOOGLE_CREDENTIAL_PATH,
+    chunk_size=ENV.STORAGE_UPLOAD_CHUNK_SIZE,
+    download_chunk_size=ENV.STORAGE_DOWNLOAD_CHUNK_SIZE,
+)
 
 firebase = FirebaseManager(ENV.GOOGLE_CREDENTIAL_PATH)
 
@@ -19,4 +38,8 @@ redis = UnifiedRedisManager(http_url=ENV.REDIS_SERVER_URL,
                             http_token=ENV.REDIS_SERVER_ACCESS_TOKEN,
                             resp_host=ENV.REDIS_RESP_HOST,
                             resp_port=ENV.REDIS_RESP_PORT,
-                            resp_password=ENV.REDIS_RESP_PASSWORD)
+                            resp_password=ENV.REDIS_RESP_PASSWORD,
+                            presence_ttl=ENV.REDIS_PRESENCE_TTL,
+                            kv_transport=ENV.REDIS_KV_TRANSPORT,
+                            max_connections=ENV.REDIS_MAX_CONNECTIONS,
+                            health_check_interval=ENV.REDIS_HEALTH_CHECK_INTERVAL)
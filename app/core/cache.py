@@ -0,0 +1,165 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache with a time-to-live per entry.
+
+    Entries expire `ttl` seconds after they are stored. When the cache is full
+    the least recently used entry is evicted. Every key carries a version that
+    is bumped on invalidation, so a read-through that raced with a write can
+    detect it and skip storing a stale value (see `version` / `set`).
+    """
+
+    def __init__(self, max_entries: int = 1024, default_ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        # Version stamps come from one global counter, so pruning the map
+        # can never make a stale stamp match again.
+        self._versions: Dict[Hashable, int] = {}
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def version(self, key: Hashable) -> int:
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float] = None,
+        version: Optional[int] = None,
+    ) -> bool:
+        """Store `value`; returns False if `version` no longer matches."""
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return False
+        with self._lock:
+            if version is not None and self._versions.get(key, 0) != version:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._bump(key)
+            self.invalidations += 1
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+                self._bump(key)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in self._data:
+                self._bump(key)
+            self._data.clear()
+
+    def _bump(self, key: Hashable) -> None:
+        if len(self._versions) >= self.max_entries * 4:
+            self._versions.clear()
+        self._versions[key] = next(self._counter)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def copy_document(value: Any) -> Any:
+    """Copy the dict/list skeleton of a Firestore document.
+
+    Callers freely mutate documents they read; leaf values (including
+    DocumentReference and timestamps) are shared rather than deep-copied.
+    """
+    if isinstance(value, dict):
+        return {k: copy_document(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_document(v) for v in value]
+    return value
+
+
+class DocumentCache:
+    """Read-through cache of Firestore documents keyed by (collection, doc_id).
+
+    Only collections listed in `ttls` are cached, each with its own TTL.
+    A single instance can be shared by the sync and async managers so that
+    a write through either one invalidates reads through both.
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int = 1024):
+        self.ttls = dict(ttls)
+        self.store = TTLCache(max_entries=max_entries)
+
+    def enabled_for(self, collection_name: str) -> bool:
+        return self.ttls.get(collection_name, 0) > 0
+
+    def get(self, collection_name: str, doc_id: str) -> Optional[dict]:
+        if not self.enabled_for(collection_name):
+            return None
+        doc = self.store.get((collection_name, doc_id))
+        return copy_document(doc) if doc is not None else None
+
+    def version(self, collection_name: str, doc_id: str) -> int:
+        return self.store.version((collection_name, doc_id))
+
+    def put(self, collection_name: str, doc_id: str, doc: dict, version: int) -> None:
+        if doc is None or not self.enabled_for(collection_name):
+            return
+        self.store.set(
+            (collection_name, doc_id),
+            copy_document(doc),
+            ttl=self.ttls[collection_name],
+            version=version,
+        )
+
+    def invalidate(self, collection_name: str, doc_id: str) -> None:
+        if self.enabled_for(collection_name):
+            self.store.invalidate((collection_name, doc_id))
+
+    def invalidate_collection(self, collection_name: str) -> None:
+        if self.enabled_for(collection_name):
+            self.store.invalidate_where(lambda key: key[0] == collection_name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.store.stats(), "ttls": self.ttls}
@@ -0,0 +1,409 @@
+from typing import Optional
+from google.cloud import firestore
+from google.oauth2 import service_account
+from app.core.cache import DocumentCache
+from app.core.db.query import (
+    DOCUMENT_ID,
+    InvalidCursor,
+    build_query,
+    normalize_order_by,
+    orders_by_id_only,
+)
+from app.settings import logger
+
+
+class AsyncFirestoreManager:
+    """Non-blocking counterpart of FirestoreManager built on firestore.AsyncClient.
+
+    Exposes the same method surface, but every call that talks to Firestore
+    is a coroutine so `async def` handlers don't stall the event loop.
+    """
+
+    def __init__(self, database_name, credential_path=None, cache: Optional[DocumentCache] = None):
+        self.cache = cache
+        try:
+            if credential_path:
+                credentials = service_account.Credentials.from_service_account_file(
+                    credential_path)
+                # Initialize async Firestore client
+                self.db = firestore.AsyncClient(
+                    credentials=credentials, database=database_name)
+            else:
+                self.db = firestore.AsyncClient(database=database_name)
+            logger.info("Async Firestore client initialized successfully.")
+        except Exception as e:
+            logger.error(f"Failed to initialize async Firestore client: {e}")
+            raise
+
+    async def add_data(self, collection_name, doc_id, data, merge=False):
+        """Add or update a document in Firestore."""
+        try:
+            doc_ref = self.db.collection(collection_name).document(doc_id)
+            await doc_ref.set(data, merge=merge)
+            self._invalidate(collection_name, doc_id)
+            logger.info(
+                f"Document '{doc_id}' added/updated in collection '{collection_name}'.")
+            return doc_ref
+        except Exception as e:
+            logger.error(f"Failed to add data to Firestore: {e}")
+            raise
+
+    def get_document_ref(self, document_path):
+        try:
+            doc_ref = self.db.document(document_path)
+            return doc_ref
+        except Exception as e:
+            raise Exception(f"Failed to get document reference: {e}")
+
+    def get_doc_ref(self, collection_name, doc_id):
+        """Get a reference to a Firestore document."""
+        return self.db.collection(collection_name).document(doc_id)
+
+    async def read_data(self, collection_name, doc_id):
+        """Read a document from Firestore (served from the cache when enabled)."""
+        if self.cache:
+            cached = self.cache.get(collection_name, doc_id)
+            if cached is not None:
+                return cached
+            version = self.cache.version(collection_name, doc_id)
+        try:
+            doc_ref = self.db.collection(collection_name).document(doc_id)
+            doc = await doc_ref.get()
+            if doc.exists:
+                logger.info(
+                    f"Document '{doc_id}' fetched successfully from '{collection_name}'.")
+                data = doc.to_dict()
+                if self.cache:
+                    self.cache.put(collection_name, doc_id, data, version)
+                return data
+            else:
+                logger.warning(
+                    f"Document '{doc_id}' does not exist in '{collection_name}'.")
+                return None
+        except Exception as e:
+            logger.error(f"Failed to read data from Firestore: {e}")
+            raise
+
+    async def read_many(self, collection_name, doc_ids, chunk_size=100):
+        """Read several documents with batched get_all round trips.
+
+        Returns a list aligned with `doc_ids`; missing documents are None.
+        """
+        col_ref = self.db.collection(collection_name)
+        results, versions = {}, {}
+        for doc_id in dict.fromkeys(doc_ids):
+            cached = self.cache.get(collection_name, doc_id) if self.cache else None
+            if cached is not None:
+                results[doc_id] = cached
+            elif self.cache:
+                versions[doc_id] = self.cache.version(collection_name, doc_id)
+        missing = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id not in results]
+        found = await self._get_all(
+            [col_ref.document(doc_id) for doc_id in missing], chunk_size)
+        for doc_id in missing:
+            data = found.get(col_ref.document(doc_id).path)
+            results[doc_id] = data
+            if self.cache and data is not None:
+                self.cache.put(collection_name, doc_id, data, versions[doc_id])
+        logger.info(
+            f"Fetched {len(found)}/{len(missing)} documents from '{collection_name}'.")
+        return [results[doc_id] for doc_id in doc_ids]
+
+    async def read_refs(self, doc_refs, chunk_size=100):
+        """Read documents from a list of references with batched get_all
+        round trips. Returns a list aligned with `doc_refs`.
+        """
+        unique_refs = list({ref.path: ref for ref in doc_refs}.values())
+        found = await self._get_all(unique_refs, chunk_size)
+        return [found.get(ref.path) for ref in doc_refs]
+
+    async def _get_all(self, doc_refs, chunk_size):
+        """Fetch `doc_refs` in chunks of `chunk_size`, keyed by document path."""
+        try:
+            found = {}
+            for i in range(0, len(doc_refs), chunk_size):
+                async for doc in self.db.get_all(doc_refs[i: i + chunk_size]):
+                    if doc.exists:
+                        found[doc.reference.path] = doc.to_dict()
+            return found
+        except Exception as e:
+            logger.error(f"Failed to batch read documents from Firestore: {e}")
+            raise
+
+    async def read_data_by_mobile(self, collection_name, mobile_number):
+        """Read a document from Firestore by mobile number."""
+        try:
+            query = self.db.collection(collection_name).where(
+                "mobile_number", "==", mobile_number)
+            documents = [doc.to_dict() async for doc in query.stream()]
+
+            if documents:
+                logger.debug(
+                    f"Document with mobile number '{mobile_number}' fetched successfully from '{collection_name}'.")
+                return documents[0]  # Return the single matching document
+            else:
+                logger.debug(
+                    f"No document found with mobile number '{mobile_number}' in '{collection_name}'.")
+                return None
+        except Exception as e:
+            logger.error(
+                f"Failed to read data by mobile number from Firestore: {e}")
+            raise
+
+    async def read_data_by_key_equal(self, collection_name, key_name, key_value):
+        """Read all documents from Firestore where `key_name` equals `key_value`."""
+        try:
+            query = self.db.collection(collection_name).where(
+                key_name, "==", key_value)
+            documents = [doc.to_dict() async for doc in query.stream()]
+
+            if documents:
+                logger.debug(
+                    f"Document with {key_name} '{key_value}' fetched successfully from '{collection_name}'.")
+                return documents
+            else:
+                logger.debug(
+                    f"No document found with {key_name} '{key_value}' in '{collection_name}'.")
+                return None
+        except Exception as e:
+            logger.error(
+                f"Failed to read data by {key_name} from Firestore: {e}")
+            raise
+
+    async def delete_data(self, collection_name, doc_id):
+        """Delete a document from Firestore."""
+        try:
+            doc_ref = self.db.collection(collection_name).document(doc_id)
+            await doc_ref.delete()
+            self._invalidate(collection_name, doc_id)
+            logger.info(
+                f"Document '{doc_id}' deleted from collection '{collection_name}'.")
+        except Exception as e:
+            logger.error(f"Failed to delete data from Firestore: {e}")
+            raise
+
+    async def append_data(self, collection_name: str, doc_id: str, data: dict):
+        try:
+            doc_ref = self.db.collection(collection_name).document(doc_id)
+            await doc_ref.set({"messages": firestore.ArrayUnion([data])}, merge=True)
+            self._invalidate(collection_name, doc_id)
+            logger.debug(
+                f"Append data into Document '{doc_id}' in collection '{collection_name}'.")
+        except Exception as e:
+            logger.error(f"Failed to update data in Firestore: {e}")
+            raise
+
+    async def update_data(self, collection_name, doc_id, data):
+        """Update specific fields in a Firestore document."""
+        try:
+            doc_ref = self.db.collection(collection_name).document(doc_id)
+            await doc_ref.update(data)
+            self._invalidate(collection_name, doc_id)
+            logger.info(
+                f"Document '{doc_id}' updated in collection '{collection_name}'.")
+        except Exception as e:
+            logger.error(f"Failed to update data in Firestore: {e}")
+            raise
+
+    def _invalidate(self, collection_name, doc_id):
+        if self.cache:
+            self.cache.invalidate(collection_name, doc_id)
+
+    def cache_stats(self):
+        """Hit/miss counters of the read-through cache ({} when disabled)."""
+        return self.cache.stats() if self.cache else {}
+
+    def array_union(self, values: list):
+        """Returns a special value that can be used with set(), create() or update()
+        that tells the server to union the given elements with any array value
+        that already exists on the server.
+        """
+        return firestore.ArrayUnion(values)
+
+    async def query(self, collection_name, filters=None, select=None, order_by=None,
+              limit=None, start_after=None):
+        """Run a server-side query and return the matching documents.
+
+        filters: (field, op, value) tuples; select: fields to project;
+        order_by: field or list of fields ('-' prefix for descending);
+        start_after: id of the last document of the previous page.
+        """
+        try:
+            docs = await self._run_query(
+                collection_name, filters, select, order_by, limit, start_after)
+            logger.info(
+                f"Queried {len(docs)} documents from collection '{collection_name}'.")
+            return [doc.to_dict() for doc in docs]
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to query '{collection_name}': {e}")
+            raise
+
+    async def stream_query(self, collection_name, filters=None, select=None,
+                           order_by=None, start_after=None):
+        """Return an async generator over a query's documents, one dict at a time.
+
+        Unlike query(), nothing is materialized, so memory stays bounded by
+        a single document regardless of collection size.
+        """
+        # Built eagerly so a bad cursor fails before any response is sent
+        query = await self._build_cursor_query(
+            collection_name, filters, select, order_by, None, start_after)
+        return self._iter_documents(collection_name, query.stream())
+
+    async def _iter_documents(self, collection_name, docs):
+        count = 0
+        async for doc in docs:
+            count += 1
+            yield doc.to_dict()
+        logger.info(
+            f"Streamed {count} documents from collection '{collection_name}'.")
+
+    async def read_page(self, collection_name, page_size, cursor=None, filters=None,
+                  select=None, order_by=None):
+        """Cursor pagination over a query.
+
+        Returns (documents, next_cursor); next_cursor is the id to pass as
+        `cursor` for the following page, or None on the last page.
+        """
+        try:
+            docs = await self._run_query(
+                collection_name, filters, select, order_by, page_size + 1, cursor)
+            next_cursor = docs[page_size - 1].id if len(docs) > page_size else None
+            logger.info(
+                f"Fetched page of {min(len(docs), page_size)} documents from '{collection_name}'.")
+            return [doc.to_dict() for doc in docs[:page_size]], next_cursor
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to read page from '{collection_name}': {e}")
+            raise
+
+    async def _run_query(self, collection_name, filters, select, order_by, limit, start_after):
+        query = await self._build_cursor_query(
+            collection_name, filters, select, order_by, limit, start_after)
+        return [doc async for doc in query.stream()]
+
+    async def _build_cursor_query(self, collection_name, filters, select, order_by, limit,
+                            start_after):
+        col_ref = self.db.collection(collection_name)
+        if start_after and not normalize_order_by(order_by):
+            # Cursors need a defined order; default to document id order.
+            order_by = DOCUMENT_ID
+        query = build_query(col_ref, filters, select, order_by, limit)
+        if start_after:
+            if orders_by_id_only(order_by):
+                query = query.start_after({DOCUMENT_ID: col_ref.document(start_after)})
+            else:
+                snapshot = await col_ref.document(start_after).get()
+                if not snapshot.exists:
+                    raise InvalidCursor(f"Invalid cursor '{start_after}'")
+                query = query.start_after(snapshot)
+        return query
+
+    async def read_all_documents(self, collection_name):
+        """Read all documents from a collection."""
+        try:
+            docs = self.db.collection(collection_name).stream()
+            all_docs = [doc.to_dict() async for doc in docs]
+            logger.info(
+                f"Fetched all documents from collection '{collection_name}'.")
+            return all_docs
+        except Exception as e:
+            logger.error(
+                f"Failed to fetch all documents from '{collection_name}': {e}")
+            raise
+
+    async def read_raw_all_documents(self, collection_name):
+        """Read all documents from a collection."""
+        try:
+            docs = self.db.collection(collection_name).stream()
+            all_docs = [doc async for doc in docs]
+            logger.info(
+                f"Fetched all documents from collection '{collection_name}'.")
+            return all_docs
+        except Exception as e:
+            logger.error(
+                f"Failed to fetch all documents from '{collection_name}': {e}")
+            raise
+
+    async def create_collection(self, collection_name, doc_id=None, data=None):
+        """Ensure a collection exists by creating a document in it.
+
+        If doc_id is provided the document will be created/overwritten with
+        `data` (or an empty dict). If doc_id is None, an auto-id document is
+        created. Returns the created document id.
+        """
+        try:
+            col_ref = self.db.collection(collection_name)
+            if doc_id:
+                doc_ref = col_ref.document(doc_id)
+                await doc_ref.set(data or {})
+                created_id = doc_ref.id
+                self._invalidate(collection_name, doc_id)
+            else:
+                # add() returns (update_time, document_reference) on the async client
+                _, doc_ref = await col_ref.add(data or {})
+                created_id = doc_ref.id
+
+            logger.info(
+                f"Collection '{collection_name}' ensured (doc id: {created_id}).")
+            return created_id
+        except Exception as e:
+            logger.error(
+                f"Failed to create collection '{collection_name}': {e}")
+            raise
+
+    async def _delete_collection_recursive(self, collection_ref, batch_size=100):
+        """Recursively delete all documents in a collection and its subcollections.
+
+        Mirrors FirestoreManager._delete_collection_recursive using the async
+        client's async iterators.
+        """
+        try:
+            docs = [doc_ref async for doc_ref in collection_ref.list_documents()]
+            # Process in batches
+            for i in range(0, len(docs), batch_size):
+                batch = self.db.batch()
+                batch_docs = docs[i: i + batch_size]
+
+                for doc_ref in batch_docs:
+                    # Recursively delete any subcollections under this document
+                    try:
+                        async for subcol in doc_ref.collections():
+                            await self._delete_collection_recursive(
+                                subcol, batch_size=batch_size)
+                    except Exception:
+                        # If listing collections fails, continue with deletion of doc
+                        logger.warning(
+                            f"Failed to list subcollections for doc '{doc_ref.id}' in '{collection_ref.id}'.")
+
+                    batch.delete(doc_ref)
+
+                await batch.commit()
+
+            # Check again in case new documents appeared while deleting.
+            remaining = [doc_ref async for doc_ref in collection_ref.list_documents()]
+            if remaining:
+                await self._delete_collection_recursive(
+                    collection_ref, batch_size=batch_size)
+        except Exception as e:
+            logger.error(
+                f"Failed to delete collection '{collection_ref.id}': {e}")
+            raise
+
+    async def delete_collection(self, collection_name, batch_size=100):
+        """Delete all documents in a collection (recursively deletes subcollections)."""
+        try:
+            collection_ref = self.db.collection(collection_name)
+            await self._delete_collection_recursive(
+                collection_ref, batch_size=batch_size)
+            if self.cache:
+                self.cache.invalidate_collection(collection_name)
+            logger.info(
+                f"Collection '{collection_name}' deleted (all documents removed).")
+        except Exception as e:
+            logger.error(
+                f"Failed to delete collection '{collection_name}': {e}")
+            raise
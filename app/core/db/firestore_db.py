@@ -1,10 +1,20 @@
+from typing import Optional
 from google.cloud import firestore
 from google.oauth2 import service_account
+from app.core.cache import DocumentCache
+from app.core.db.query import (
+    DOCUMENT_ID,
+    InvalidCursor,
+    build_query,
+    normalize_order_by,
+    orders_by_id_only,
+)
 from app.settings import logger
 
 
 class FirestoreManager:
-    def __init__(self, database_name, credential_path=None):
+    def __init__(self, database_name, credential_path=None, cache: Optional[DocumentCache] = None):
+        self.cache = cache
         # service_account.Credentials.from_service_account_info()
         try:
             if credential_path:
@@ -20,11 +30,12 @@ class FirestoreManager:
             logger.error(f"Failed to initialize Firestore client: {e}")
             raise
 
-    def add_data(self, collection_name, doc_id, data):
+    def add_data(self, collection_name, doc_id, data, merge=False):
         """Add or update a document in Firestore."""
         try:
             doc_ref = self.db.collection(collection_name).document(doc_id)
-            doc_ref.set(data)
+            doc_ref.set(data, merge=merge)
+            self._invalidate(collection_name, doc_id)
             logger.info(
                 f"Document '{doc_id}' added/updated in collection '{collection_name}'.")
             return doc_ref
@@ -44,14 +55,22 @@ class FirestoreManager:
         return self.db.collection(collection_name).document(doc_id)
 
     def read_data(self, collection_name, doc_id):
-        """Read a document from Firestore."""
+        """Read a document from Firestore (served from the cache when enabled)."""
+        if self.cache:
+            cached = self.cache.get(collection_name, doc_id)
+            if cached is not None:
+                return cached
+            version = self.cache.version(collection_name, doc_id)
         try:
             doc_ref = self.db.collection(collection_name).document(doc_id)
             doc = doc_ref.get()
             if doc.exists:
                 logger.info(
                     f"Document '{doc_id}' fetched successfully from '{collection_name}'.")
-                return doc.to_dict()
+                data = doc.to_dict()
+                if self.cache:
+                    self.cache.put(collection_name, doc_id, data, version)
+                return data
             else:
                 logger.warning(
                     f"Document '{doc_id}' does not exist in '{collection_name}'.")
@@ -60,6 +79,54 @@ class FirestoreManager:
             logger.error(f"Failed to read data from Firestore: {e}")
             raise
 
+    def read_many(self, collection_name, doc_ids, chunk_size=100):
+        """Read several documents with batched get_all round trips.
+
+        Returns a list aligned with `doc_ids`; missing documents are None.
+        """
+        col_ref = self.db.collection(collection_name)
+        results, versions = {}, {}
+        for doc_id in dict.fromkeys(doc_ids):
+            cached = self.cache.get(collection_name, doc_id) if self.cache else None
+            if cached is not None:
+                results[doc_id] = cached
+            elif self.cache:
+                versions[doc_id] = self.cache.version(collection_name, doc_id)
+        missing = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id not in results]
+        found = self._get_all(
+            [col_ref.document(doc_id) for doc_id in missing], chunk_size)
+        for doc_id in missing:
+            data = found.get(col_ref.document(doc_id).path)
+            results[doc_id] = data
+            if self.cache and data is not None:
+                self.cache.put(collection_name, doc_id, data, versions[doc_id])
+        logger.info(
+            f"Fetched {len(found)}/{len(missing)} documents from '{collection_name}'.")
+        return [results[doc_id] for doc_id in doc_ids]
+
+    def read_refs(self, doc_refs, chunk_size=100):
+        """Read documents from a list of references (e.g. stored in other
+        documents) with batched get_all round trips.
+
+        Returns a list aligned with `doc_refs`; missing documents are None.
+        """
+        unique_refs = list({ref.path: ref for ref in doc_refs}.values())
+        found = self._get_all(unique_refs, chunk_size)
+        return [found.get(ref.path) for ref in doc_refs]
+
+    def _get_all(self, doc_refs, chunk_size):
+        """Fetch `doc_refs` in chunks of `chunk_size`, keyed by document path."""
+        try:
+            found = {}
+            for i in range(0, len(doc_refs), chunk_size):
+                for doc in self.db.get_all(doc_refs[i: i + chunk_size]):
+                    if doc.exists:
+                        found[doc.reference.path] = doc.to_dict()
+            return found
+        except Exception as e:
+            logger.error(f"Failed to batch read documents from Firestore: {e}")
+            raise
+
     def read_data_by_mobile(self, collection_name, mobile_number):
         """Read a document from Firestore by mobile number."""
         try:
@@ -107,6 +174,7 @@ class FirestoreManager:
         try:
             doc_ref = self.db.collection(collection_name).document(doc_id)
             doc_ref.delete()
+            self._invalidate(collection_name, doc_id)
             logger.info(
                 f"Document '{doc_id}' deleted from collection '{collection_name}'.")
         except Exception as e:
@@ -117,6 +185,7 @@ class FirestoreManager:
         try:
             doc_ref = self.db.collection(collection_name).document(doc_id)
             doc_ref.set({"messages": firestore.ArrayUnion([data])}, merge=True)
+            self._invalidate(collection_name, doc_id)
             logger.debug(
                 f"Append data into Document '{doc_id}' in collection '{collection_name}'.")
         except Exception as e:
@@ -128,12 +197,21 @@ class FirestoreManager:
         try:
             doc_ref = self.db.collection(collection_name).document(doc_id)
             doc_ref.update(data)
+            self._invalidate(collection_name, doc_id)
             logger.info(
                 f"Document '{doc_id}' updated in collection '{collection_name}'.")
         except Exception as e:
             logger.error(f"Failed to update data in Firestore: {e}")
             raise
 
+    def _invalidate(self, collection_name, doc_id):
+        if self.cache:
+            self.cache.invalidate(collection_name, doc_id)
+
+    def cache_stats(self):
+        """Hit/miss counters of the read-through cache ({} when disabled)."""
+        return self.cache.stats() if self.cache else {}
+
     def array_union(self, values: list):
         """Returns a special value that can be used with set(), create() or update()
         that tells the server to union the given elements with any array value
@@ -141,6 +219,88 @@ class FirestoreManager:
         """
         return firestore.ArrayUnion(values)
 
+    def query(self, collection_name, filters=None, select=None, order_by=None,
+              limit=None, start_after=None):
+        """Run a server-side query and return the matching documents.
+
+        filters: (field, op, value) tuples; select: fields to project;
+        order_by: field or list of fields ('-' prefix for descending);
+        start_after: id of the last document of the previous page.
+        """
+        try:
+            docs = self._run_query(
+                collection_name, filters, select, order_by, limit, start_after)
+            logger.info(
+                f"Queried {len(docs)} documents from collection '{collection_name}'.")
+            return [doc.to_dict() for doc in docs]
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to query '{collection_name}': {e}")
+            raise
+
+    def stream_query(self, collection_name, filters=None, select=None,
+                     order_by=None, start_after=None):
+        """Generator over a query's documents, one dict at a time.
+
+        Unlike query(), nothing is materialized, so memory stays bounded by
+        a single document regardless of collection size.
+        """
+        # Built eagerly so a bad cursor fails before any response is sent
+        query = self._build_cursor_query(
+            collection_name, filters, select, order_by, None, start_after)
+        return self._iter_documents(collection_name, query.stream())
+
+    def _iter_documents(self, collection_name, docs):
+        count = 0
+        for doc in docs:
+            count += 1
+            yield doc.to_dict()
+        logger.info(
+            f"Streamed {count} documents from collection '{collection_name}'.")
+
+    def read_page(self, collection_name, page_size, cursor=None, filters=None,
+                  select=None, order_by=None):
+        """Cursor pagination over a query.
+
+        Returns (documents, next_cursor); next_cursor is the id to pass as
+        `cursor` for the following page, or None on the last page.
+        """
+        try:
+            docs = self._run_query(
+                collection_name, filters, select, order_by, page_size + 1, cursor)
+            next_cursor = docs[page_size - 1].id if len(docs) > page_size else None
+            logger.info(
+                f"Fetched page of {min(len(docs), page_size)} documents from '{collection_name}'.")
+            return [doc.to_dict() for doc in docs[:page_size]], next_cursor
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to read page from '{collection_name}': {e}")
+            raise
+
+    def _run_query(self, collection_name, filters, select, order_by, limit, start_after):
+        query = self._build_cursor_query(
+            collection_name, filters, select, order_by, limit, start_after)
+        return list(query.stream())
+
+    def _build_cursor_query(self, collection_name, filters, select, order_by, limit,
+                            start_after):
+        col_ref = self.db.collection(collection_name)
+        if start_after and not normalize_order_by(order_by):
+            # Cursors need a defined order; default to document id order.
+            order_by = DOCUMENT_ID
+        query = build_query(col_ref, filters, select, order_by, limit)
+        if start_after:
+            if orders_by_id_only(order_by):
+                query = query.start_after({DOCUMENT_ID: col_ref.document(start_after)})
+            else:
+                snapshot = col_ref.document(start_after).get()
+                if not snapshot.exists:
+                    raise InvalidCursor(f"Invalid cursor '{start_after}'")
+                query = query.start_after(snapshot)
+        return query
+
     def read_all_documents(self, collection_name):
         """Read all documents from a collection."""
         try:
@@ -180,6 +340,7 @@ class FirestoreManager:
                 doc_ref = col_ref.document(doc_id)
                 doc_ref.set(data or {})
                 created_id = doc_ref.id
+                self._invalidate(collection_name, doc_id)
             else:
                 doc_ref = col_ref.add(data or {})
                 # add() returns (document_reference, write_result)
@@ -244,6 +405,8 @@ class FirestoreManager:
             # start recursive deletion
             self._delete_collection_recursive(
                 collection_ref, batch_size=batch_size)
+            if self.cache:
+                self.cache.invalidate_collection(collection_name)
             logger.info(
                 f"Collection '{collection_name}' deleted (all documents removed).")
         except Exception as e:
@@ -0,0 +1,52 @@
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+from google.cloud import firestore
+
+DOCUMENT_ID = "__name__"
+
+Filter = Tuple[str, str, object]
+
+
+class InvalidCursor(ValueError):
+    """A pagination cursor names a document that doesn't exist."""
+
+
+def normalize_order_by(order_by: Union[str, Sequence[str], None]) -> List[str]:
+    """Return order fields as a list; a leading '-' means descending."""
+    if not order_by:
+        return []
+    if isinstance(order_by, str):
+        return [order_by]
+    return list(order_by)
+
+
+def build_query(
+    col_ref,
+    filters: Optional[Iterable[Filter]] = None,
+    select: Optional[Sequence[str]] = None,
+    order_by: Union[str, Sequence[str], None] = None,
+    limit: Optional[int] = None,
+):
+    """Apply where/select/order_by/limit to a (sync or async) collection reference.
+
+    filters: (field, op, value) tuples, e.g. ("course_type", "==", "pdf")
+    select: field paths to project; other fields are not transferred
+    order_by: field path or list of them, prefix with '-' for descending
+    """
+    query = col_ref
+    for field, op, value in filters or []:
+        query = query.where(filter=firestore.FieldFilter(field, op, value))
+    if select:
+        query = query.select(list(select))
+    for field in normalize_order_by(order_by):
+        if field.startswith("-"):
+            query = query.order_by(field[1:], direction=firestore.Query.DESCENDING)
+        else:
+            query = query.order_by(field)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def orders_by_id_only(order_by: Union[str, Sequence[str], None]) -> bool:
+    fields = normalize_order_by(order_by)
+    return fields in ([], [DOCUMENT_ID], ["-" + DOCUMENT_ID])
@@ -2,6 +2,7 @@ from typing import Optional
 from fastapi import HTTPException
 import firebase_admin
 from firebase_admin import credentials, auth
+from app.settings import logger
 
 
 class FirebaseManager:
@@ -20,3 +21,19 @@ class FirebaseManager:
         except Exception as e:
             raise HTTPException(
                 status_code=401, detail=f"Invalid or expired token {e}")
+
+    def prewarm_certs(self):
+        """Load Google's ID-token signing certs into firebase_admin's HTTP cache.
+
+        Goes through the verifier's own (cache-control aware) request object,
+        which is not public API, so failures are only logged: the first
+        verify_token() will fetch the certs as usual.
+        """
+        try:
+            from firebase_admin import _token_gen
+
+            verifier = auth._get_client(self.client)._token_verifier
+            response = verifier.request(_token_gen.ID_TOKEN_CERT_URI, method="GET")
+            logger.info(f"Prefetched Firebase ID token certs (HTTP {response.status})")
+        except Exception as e:
+            logger.warning(f"Failed to prefetch Firebase ID token certs: {e}")
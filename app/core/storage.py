@@ -1,12 +1,17 @@
 from google.cloud import storage
 from google.api_core.exceptions import NotFound
 from google.oauth2 import service_account
-from typing import Optional
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+# Resumable upload chunks must be a multiple of 256 KiB
+CHUNK_MULTIPLE = 256 * 1024
 
 
 class StorageManager:
 
-    def __init__(self, credential_path=None) -> None:
+    def __init__(self, credential_path=None, chunk_size: int = 8 * 1024 * 1024, download_chunk_size: int = 1024 * 1024) -> None:
+        self.chunk_size = max(CHUNK_MULTIPLE, chunk_size // CHUNK_MULTIPLE * CHUNK_MULTIPLE)
+        self.download_chunk_size = download_chunk_size
         if credential_path:
             credentials = service_account.Credentials.from_service_account_file(
                 credential_path)
@@ -32,6 +37,47 @@ class StorageManager:
         blob.upload_from_string(image_bytes, content_type=content_type)
         return blob.public_url
 
+    def upload_stream(self, file_obj: BinaryIO, *, bucket_name: Optional[str] = None, blob_name: Optional[str] = None, content_type: str = "application/octet-stream", size: Optional[int] = None) -> str:
+        """Upload a file object as a resumable upload of `chunk_size` chunks.
+
+        Only one chunk is in memory at a time. The CRC32C of the data is
+        computed while sending and checked against the stored object; on a
+        mismatch the object is deleted and DataCorruption is raised.
+        """
+
+        if bucket_name is None:
+            raise ValueError(
+                "bucket_name must be provided (or set default_bucket on StorageManager)")
+
+        if not blob_name:
+            raise ValueError("blob_name must be provided")
+
+        bucket = self.client.bucket(bucket_name)
+        blob = bucket.blob(blob_name, chunk_size=self.chunk_size)
+        blob.upload_from_file(
+            file_obj,
+            rewind=True,
+            size=size,
+            content_type=content_type,
+            checksum="crc32c",
+        )
+        return blob.public_url
+
+    @staticmethod
+    def rendition_name(blob_name: str, width: int, fmt: str) -> str:
+        """Blob holding `blob_name` resized to `width` px and encoded as `fmt`."""
+        return f"{blob_name}.w{width}.{fmt}"
+
+    def upload_renditions(self, renditions: Dict[Tuple[int, str], bytes], *, bucket_name: Optional[str] = None, blob_name: str) -> None:
+        """Store renditions keyed by (width, format) next to `blob_name`."""
+        for (width, fmt), data in renditions.items():
+            self.upload_bytes(
+                data,
+                bucket_name=bucket_name,
+                blob_name=self.rendition_name(blob_name, width, fmt),
+                content_type=f"image/{fmt}",
+            )
+
     def get_bytes(self, *, bucket_name: Optional[str] = None, blob_name: str) -> bytes:
 
         if bucket_name is None:
@@ -44,8 +90,53 @@ class StorageManager:
         bucket = self.client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
 
-        if not blob.exists():
+        # Raises NotFound itself; no separate exists() round trip
+        return blob.download_as_bytes()
+
+    def open_stream(self, *, bucket_name: Optional[str] = None, blob_name: str) -> "BlobStream":
+        """Fetch a blob's metadata (one request) for chunked reads of its bytes.
+
+        Raises NotFound if the blob doesn't exist.
+        """
+
+        if bucket_name is None:
+            raise ValueError(
+                "bucket_name must be provided (or set default_bucket on StorageManager)")
+
+        if not blob_name:
+            raise ValueError("blob_name must be provided")
+
+        blob = self.client.bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
             raise NotFound(
                 f"Blob '{blob_name}' not found in bucket '{bucket_name}'")
+        return BlobStream(blob, self.download_chunk_size)
 
-        return blob.download_as_bytes()
+
+class BlobStream:
+    """An opened blob: its metadata and lazy, chunked reads of its content.
+
+    Every chunk is read from the generation whose metadata was fetched, so
+    a blob replaced mid-download fails instead of mixing two versions.
+    """
+
+    def __init__(self, blob: storage.Blob, chunk_size: int) -> None:
+        self.blob = blob
+        self.chunk_size = chunk_size
+        self.size: int = blob.size or 0
+        self.content_type: Optional[str] = blob.content_type
+        self.etag: Optional[str] = blob.etag
+
+    def chunks(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Yield bytes `start`..`end` (inclusive, default: to the end) in chunks."""
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        while start <= end:
+            chunk_end = min(start + self.chunk_size - 1, end)
+            # Checksums cover whole objects only, so ranged reads can't verify them
+            yield self.blob.download_as_bytes(
+                start=start,
+                end=chunk_end,
+                if_generation_match=self.blob.generation,
+                checksum=None,
+            )
+            start = chunk_end + 1
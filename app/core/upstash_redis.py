@@ -1,18 +1,42 @@
+import asyncio
 import time
 import uuid
-from typing import Optional, Dict, Any, List, AsyncGenerator
+from typing import Awaitable, Callable, Optional, Dict, Any, List, Set, Tuple, AsyncGenerator
 
 from upstash_redis.asyncio import Redis as UpstashHttpRedis
 from redis.asyncio import Redis as RedisAsyncio
+from redis.asyncio.connection import BlockingConnectionPool, SSLConnection
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+from app.settings import logger
+
+KV_TRANSPORTS = ("resp", "http")
 
 
 class UnifiedRedisManager:
     """
     Unified manager:
-    - Upstash HTTP client: KV, sets, hashes, streams
-    - Redis asyncio client: Pub/Sub for real-time messages
+    - Redis asyncio client (pooled RESP): Pub/Sub and, with
+      kv_transport="resp", KV/set/hash commands
+    - Upstash HTTP client: KV/set/hash commands with kv_transport="http",
+      and the fallback whenever a RESP command hits a connection error
+
+    All KV commands sent here are idempotent (sets, hash writes, expires,
+    deletes), so replaying a command over HTTP after a RESP failure is safe.
+
+    Presence keys:
+    - ws:users:active      sorted set user_id -> last heartbeat (epoch seconds)
+    - ws:instances:active  sorted set instance_id -> last heartbeat
+    - ws:user:{id}         hash {socket_id: instance_id}, expires after presence_ttl
+    - ws:socket:{id}       hash {user_id, instance_id, connected_at}, expires
+                           after presence_ttl
+    Sockets of a crashed instance stop being refreshed and age out.
     """
 
+    PRESENCE_USERS_KEY = "ws:users:active"
+    PRESENCE_INSTANCES_KEY = "ws:instances:active"
+
     def __init__(
         self,
         http_url: str,
@@ -20,62 +44,198 @@ class UnifiedRedisManager:
         resp_host: str,
         resp_port: int,
         resp_password: str,
+        presence_ttl: int = 90,
+        kv_transport: str = "resp",
+        max_connections: int = 20,
+        health_check_interval: int = 30,
+        socket_timeout: float = 5.0,
     ):
+        if kv_transport not in KV_TRANSPORTS:
+            raise ValueError(
+                f"Unknown Redis KV transport '{kv_transport}', expected one of {KV_TRANSPORTS}")
+        self.presence_ttl = presence_ttl
+        self.kv_transport = kv_transport
+        self.fallbacks = 0
+
         # HTTP client
         self.http = UpstashHttpRedis(url=http_url, token=http_token)
 
-        # RESP client for Pub/Sub
+        # RESP client; the pool is shared by Pub/Sub (one pinned connection)
+        # and KV commands, and waits for a free connection instead of failing.
         self.resp = RedisAsyncio(
-            host=resp_host,
-            port=resp_port,
-            password=resp_password,
-            ssl=True,
-            decode_responses=True,
+            connection_pool=BlockingConnectionPool(
+                connection_class=SSLConnection,
+                host=resp_host,
+                port=resp_port,
+                password=resp_password,
+                decode_responses=True,
+                max_connections=max_connections,
+                timeout=socket_timeout,
+                health_check_interval=health_check_interval,
+                socket_timeout=socket_timeout,
+                socket_connect_timeout=socket_timeout,
+            )
         )
         self.pubsub = self.resp.pubsub()
 
+    async def _kv(
+        self,
+        resp_call: Callable[[], Awaitable[Any]],
+        http_call: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Run a KV command on the configured transport, falling back to HTTP."""
+        if self.kv_transport == "resp":
+            try:
+                return await resp_call()
+            except (RedisConnectionError, RedisTimeoutError, OSError) as e:
+                self.fallbacks += 1
+                logger.warning(f"Redis RESP command failed, retrying over HTTP: {e}")
+        return await http_call()
+
+    @staticmethod
+    def _hset(pipe, key: str, values: Dict[str, str], http: bool):
+        # upstash-redis and redis-py name the field mapping differently
+        if http:
+            pipe.hset(key, values=values)
+        else:
+            pipe.hset(key, mapping=values)
+
+    async def _pipeline(self, queue: Callable[[Any, bool], None], transaction: bool = False):
+        """Send the commands queued by `queue(pipe, http)` in one round trip."""
+
+        async def resp():
+            async with self.resp.pipeline(transaction=transaction) as pipe:
+                queue(pipe, False)
+                return await pipe.execute()
+
+        async def http():
+            pipe = self.http.multi() if transaction else self.http.pipeline()
+            queue(pipe, True)
+            return await pipe.exec()
+
+        return await self._kv(resp, http)
+
     # -----------------------------
-    # User Connections (HTTP)
+    # User Connections (one round trip per call)
     # -----------------------------
-    async def add_connected_user(self, user_id: str, socket_id: str):
-        await self.http.sadd("ws:users", user_id)
-        await self.http.hset(
-            f"ws:user:{user_id}",
-            values={"socket_id": socket_id, "connected_at": str(time.time())},
-        )
-        await self.http.hset(
-            f"ws:socket:{socket_id}",
-            values={"user_id": user_id, "connected_at": str(time.time())},
-        )
+    async def add_connected_user(self, user_id: str, socket_id: str, instance_id: str):
+        now = time.time()
+
+        def queue(tx, http):
+            tx.zadd(self.PRESENCE_USERS_KEY, {user_id: now})
+            tx.zadd(self.PRESENCE_INSTANCES_KEY, {instance_id: now})
+            self._hset(tx, f"ws:user:{user_id}", {socket_id: instance_id}, http)
+            tx.expire(f"ws:user:{user_id}", self.presence_ttl)
+            self._hset(
+                tx,
+                f"ws:socket:{socket_id}",
+                {"user_id": user_id, "instance_id": instance_id, "connected_at": str(now)},
+                http,
+            )
+            tx.expire(f"ws:socket:{socket_id}", self.presence_ttl)
+
+        await self._pipeline(queue, transaction=True)
 
     async def remove_connected_user(self, user_id: str, socket_id: str):
-        await self.http.srem("ws:users", user_id)
-        await self.http.delete(f"ws:user:{user_id}")
-        await self.http.delete(f"ws:socket:{socket_id}")
+        def queue(tx, http):
+            tx.hdel(f"ws:user:{user_id}", socket_id)
+            tx.hlen(f"ws:user:{user_id}")
+            tx.delete(f"ws:socket:{socket_id}")
+
+        _, remaining, _ = await self._pipeline(queue, transaction=True)
+        if not remaining:
+            # Last socket of this user anywhere; otherwise the user stays active
+            await self._kv(
+                lambda: self.resp.zrem(self.PRESENCE_USERS_KEY, user_id),
+                lambda: self.http.zrem(self.PRESENCE_USERS_KEY, user_id),
+            )
+
+    async def refresh_connected_users(self, sockets: Dict[str, str], instance_id: str):
+        """Heartbeat for this instance's sockets ({socket_id: user_id}).
+
+        Socket fields are re-written rather than only re-expired, so a user
+        hash that was emptied by another socket's disconnect is restored.
+        """
+        now = time.time()
+
+        def queue(pipe, http):
+            pipe.zremrangebyscore(self.PRESENCE_INSTANCES_KEY, 0, now - self.presence_ttl)
+            pipe.zadd(self.PRESENCE_INSTANCES_KEY, {instance_id: now})
+            if sockets:
+                pipe.zadd(self.PRESENCE_USERS_KEY, {
+                          user_id: now for user_id in sockets.values()})
+            for socket_id, user_id in sockets.items():
+                self._hset(pipe, f"ws:user:{user_id}", {socket_id: instance_id}, http)
+                pipe.expire(f"ws:user:{user_id}", self.presence_ttl)
+                pipe.expire(f"ws:socket:{socket_id}", self.presence_ttl)
+
+        await self._pipeline(queue)
 
     async def get_connected_users(self) -> List[str]:
-        return await self.http.smembers("ws:users") or []
+        # Drop users whose sockets missed their heartbeats (crashed instances)
+        stale_before = time.time() - self.presence_ttl
+
+        def queue(pipe, http):
+            pipe.zremrangebyscore(self.PRESENCE_USERS_KEY, 0, stale_before)
+            pipe.zrange(self.PRESENCE_USERS_KEY, 0, -1)
+
+        _, users = await self._pipeline(queue)
+        return users or []
+
+    async def get_user_instances(self, user_id: str) -> Set[str]:
+        """Live instances holding at least one socket of `user_id`.
+
+        Socket fields left behind by a crashed instance are ignored once the
+        instance misses its heartbeats.
+        """
+        alive_after = time.time() - self.presence_ttl
+
+        def queue(pipe, http):
+            pipe.hgetall(f"ws:user:{user_id}")
+            pipe.zrangebyscore(self.PRESENCE_INSTANCES_KEY, alive_after, "+inf")
+
+        sockets, alive = await self._pipeline(queue)
+        return set((sockets or {}).values()) & set(alive or [])
 
     async def get_user_info(self, user_id: str) -> Optional[Dict[str, Any]]:
-        return await self.http.hgetall(f"ws:user:{user_id}")
+        """{socket_id: instance_id} for every socket of `user_id`."""
+        key = f"ws:user:{user_id}"
+        return await self._kv(lambda: self.resp.hgetall(key), lambda: self.http.hgetall(key))
 
     async def get_socket_info(self, socket_id: str) -> Optional[Dict[str, Any]]:
-        return await self.http.hgetall(f"ws:socket:{socket_id}")
+        key = f"ws:socket:{socket_id}"
+        return await self._kv(lambda: self.resp.hgetall(key), lambda: self.http.hgetall(key))
 
     # -----------------------------
     # Pub/Sub (RESP)
     # -----------------------------
-    async def subscribe(self, channel: str):
-        """Subscribe to a channel."""
-        await self.pubsub.subscribe(channel)
+    async def subscribe(self, *channels: str):
+        """Subscribe to one or more channels."""
+        await self.pubsub.subscribe(*channels)
+
+    async def unsubscribe(self, *channels: str):
+        """Unsubscribe from one or more channels."""
+        await self.pubsub.unsubscribe(*channels)
 
     async def publish(self, channel: str, message: str):
         """Publish a message."""
         await self.resp.publish(channel, message)
 
     async def listen(self) -> AsyncGenerator[Dict[str, Any], None]:
-        """Async generator to listen to messages."""
-        async for msg in self.pubsub.listen():
+        """Async generator to listen to messages.
+
+        Unlike pubsub.listen() it keeps waiting while nothing is subscribed,
+        so channels can come and go underneath a long-lived reader.
+        """
+        while True:
+            if not self.pubsub.subscribed or self.pubsub.connection is None:
+                # get_message() raises until the first subscribe opens the connection
+                await asyncio.sleep(0.5)
+                continue
+            msg = await self.pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=1.0)
+            if msg is None:
+                continue
             if msg["type"] == "message":
                 yield msg
 
@@ -85,9 +245,69 @@ class UnifiedRedisManager:
     def generate_socket_id(self) -> str:
         return str(uuid.uuid4())
 
+    async def close(self):
+        await self.pubsub.aclose()
+        await self.resp.aclose()
+
+    def transport_stats(self) -> Dict[str, Any]:
+        pool = self.resp.connection_pool
+        # Connection lists are private to redis-py; report None if they move
+        in_use = getattr(pool, "_in_use_connections", None)
+        available = getattr(pool, "_available_connections", None)
+        try:
+            open_connections = len(in_use) + len(available)
+        except TypeError:
+            open_connections = None
+        return {
+            "kv_transport": self.kv_transport,
+            "max_connections": getattr(pool, "max_connections", None),
+            "open_connections": open_connections,
+            "http_fallbacks": self.fallbacks,
+        }
+
     # -----------------------------
-    # Sets (HTTP)
+    # Sets
     # -----------------------------
     async def sadd(self, key: str, *values: Any):
         """Add one or more members to a set."""
-        return await self.http.sadd(key, *values)
+        return await self._kv(
+            lambda: self.resp.sadd(key, *values), lambda: self.http.sadd(key, *values))
+
+    async def srem(self, key: str, *values: Any):
+        """Remove one or more members from a set."""
+        return await self._kv(
+            lambda: self.resp.srem(key, *values), lambda: self.http.srem(key, *values))
+
+    async def smembers(self, key: str) -> List[str]:
+        """All members of a set (empty list if the key doesn't exist)."""
+        members = await self._kv(
+            lambda: self.resp.smembers(key), lambda: self.http.smembers(key))
+        return list(members or [])
+
+    # -----------------------------
+    # Streams
+    # -----------------------------
+    async def xadd(self, key: str, fields: Dict[str, str]) -> str:
+        """Append an entry with an auto-generated id."""
+        return await self._kv(
+            lambda: self.resp.xadd(key, fields), lambda: self.http.xadd(key, "*", fields))
+
+    async def xrange(
+        self, key: str, count: Optional[int] = None
+    ) -> List[Tuple[str, Dict[str, str]]]:
+        """Oldest entries of a stream as (entry_id, fields)."""
+        entries = await self._kv(
+            lambda: self.resp.xrange(key, count=count),
+            lambda: self.http.xrange(key, "-", "+", count=count),
+        )
+        result = []
+        for entry_id, fields in entries or []:
+            if not isinstance(fields, dict):
+                # Upstash returns fields as a flat [name, value, ...] list
+                fields = dict(zip(fields[::2], fields[1::2]))
+            result.append((entry_id, fields))
+        return result
+
+    async def xdel(self, key: str, *entry_ids: str):
+        return await self._kv(
+            lambda: self.resp.xdel(key, *entry_ids), lambda: self.http.xdel(key, *entry_ids))
@@ -1,18 +1,61 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.settings.config import TITLE, VERSION
 from app.routes import *
+from app.core import firebase, redis
+from app.core.db.query import InvalidCursor
+from app.utils.catalog_manager import catalog
+from app.utils.chat_manager import chat_dispatcher, presence
+from app.utils.image_processor import image_processor
+from app.utils.message_buffer import message_buffer
+from app.utils.message_store import message_store
+from app.utils.notifications import push_dispatcher, receipt_worker
+from app.utils.helper import NEXT_CURSOR_HEADER
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(firebase.prewarm_certs)
+    await image_processor.start()
+    await catalog.start()
+    await push_dispatcher.start()
+    await receipt_worker.start()
+    await message_buffer.start()
+    await chat_dispatcher.start()
+    await presence.start()
+    # Legacy conversations only show up in the agent inbox once migrated
+    inbox_backfill = asyncio.create_task(message_store.backfill_inbox())
+    yield
+    inbox_backfill.cancel()
+    await presence.stop()
+    await chat_dispatcher.stop()
+    await message_buffer.stop()
+    await push_dispatcher.stop()
+    await receipt_worker.stop()
+    await catalog.stop()
+    await image_processor.stop()
+    await redis.close()
+
+
+async def invalid_cursor(request: Request, exc: InvalidCursor):
+    # Raised by the DB layer for `cursor` query parameters it can't resolve
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
 
 
 def initialize_application():
-    app = FastAPI(title=TITLE, version=VERSION)
+    app = FastAPI(title=TITLE, version=VERSION, lifespan=lifespan)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER],
     )
+    app.add_exception_handler(InvalidCursor, invalid_cursor)
 
     app.include_router(common_rt)
     app.include_router(user_rt)
@@ -1,8 +1,19 @@
-import io
+import asyncio
 from typing import Literal, Optional
 import uuid
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
-from fastapi.responses import StreamingResponse
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Header,
+    Query,
+    Response,
+    UploadFile,
+    status,
+)
+from google.api_core.exceptions import NotFound
 from app.model.model import (
     SellItem,
     SellItemResponse,
@@ -11,19 +22,48 @@ from app.model.model import (
     AgentResponse,
 )
 from app.settings import ENV
-from app.core import db, docs, storage
-from app.utils.helper import extract_google_docs_id
-from app.utils.image import save_to_png
+from app.core import async_db, db, docs, storage
+from app.utils.catalog_manager import catalog
+from app.utils.helper import (
+    extract_google_docs_id,
+    ndjson_response,
+    paginate,
+    set_next_cursor,
+    stream_response,
+)
+from app.utils.renditions import image_response, save_image
 from app.utils.security import get_user_id, hash_password, verify_password
 
 
 agent_rt = APIRouter(prefix="/agent", tags=["Agent"])
 
 
+AGENT_LIST_FIELDS = ["id", "name", "email_id", "mobile_number", "bio"]
+
+
 @agent_rt.get("/list", status_code=status.HTTP_200_OK)
-def list_agents():
-    # Fetch all agents from the database
-    agents = db.read_all_documents(TableConfig.AGENT.value) or {}
+def list_agents(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
+    if stream:
+        agents = db.stream_query(
+            TableConfig.AGENT.value, select=AGENT_LIST_FIELDS, start_after=cursor
+        )
+        return ndjson_response(AgentResponse(**agent) for agent in agents)
+
+    # Fetch only the fields the response needs, one page at a time if asked
+    if limit is None:
+        agents = db.query(
+            TableConfig.AGENT.value, select=AGENT_LIST_FIELDS, start_after=cursor
+        )
+    else:
+        agents, next_cursor = db.read_page(
+            TableConfig.AGENT.value, limit, cursor, select=AGENT_LIST_FIELDS
+        )
+        set_next_cursor(response, next_cursor)
 
     # Format the response to include only necessary details
     agent_list = [AgentResponse(**agent) for agent in agents]
@@ -63,8 +103,7 @@ def list_followers(agent_mobile: str):
     # Get followers' details
     followers = agent.get("followers", [])
     follower_details = []
-    for follower_id in followers:
-        user = db.read_data(TableConfig.USER.value, follower_id)
+    for user in db.read_many(TableConfig.USER.value, followers):
         if user:
             follower_details.append(
                 {
@@ -102,32 +141,26 @@ async def add_selling_item(
         raise HTTPException(status_code=400, detail="Uploaded image is empty")
 
     id = str(uuid.uuid4())
-    thumbnail_image_bytes = save_to_png(image_bytes)
-
     blob_name = f"sell_item/{id}/thumbnail.png"
-    storage.upload_bytes(
-        image_bytes=thumbnail_image_bytes,
-        bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
-        blob_name=blob_name,
-        content_type="image/png",
-    )
+    await save_image(image_bytes, "png", blob_name=blob_name, content_type="image/png")
     filename = ""
     docs_id = ""
     if content == "PDF" and pdf:
+        filename = str(pdf.filename)
+        pdf_blob_name = f"sell_item/{id}/{filename}"
         try:
-            pdf_bytes = await pdf.read()
+            await asyncio.to_thread(
+                storage.upload_stream,
+                pdf.file,
+                bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
+                blob_name=pdf_blob_name,
+                content_type="application/pdf",
+                size=pdf.size,
+            )
         except Exception as e:
             raise HTTPException(
-                status_code=500, detail=f"Failed to read uploaded file: {e}"
+                status_code=500, detail=f"Failed to upload file: {e}"
             )
-        filename = str(pdf.filename)
-        pdf_blob_name = f"sell_item/{id}/{filename}"
-        storage.upload_bytes(
-            image_bytes=pdf_bytes,
-            bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
-            blob_name=pdf_blob_name,
-            content_type="application/pdf",
-        )
     elif content == "DOCS" and url:
         docs_id = extract_google_docs_id(url)
         if not docs_id:
@@ -145,7 +178,7 @@ async def add_selling_item(
         filename=filename,
     )
 
-    db.add_data(TableConfig.SELL_ITEM.name, id, item.model_dump())
+    await async_db.add_data(TableConfig.SELL_ITEM.name, id, item.model_dump())
     return {"message": "Item added successfully"}
 
 
@@ -166,13 +199,23 @@ def update_selling_item(id: str, data: SellItemUpdate):
 
 
 @agent_rt.get("/sell/item")
-async def fetch_doc():
-    items = db.read_all_documents(TableConfig.SELL_ITEM.name)
-    return [SellItemResponse(**item) for item in items]
+async def fetch_doc(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+):
+    items, next_cursor = paginate(
+        await catalog.items_async(TableConfig.SELL_ITEM.name), limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return [SellItemResponse(**item.model_dump()) for item in items]
 
 
 @agent_rt.get("/sell/item/{id}")
-def fetch_docs_html(id):
+def fetch_docs_html(
+    id,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+):
     item = db.read_data(TableConfig.SELL_ITEM.name, id)
     if not item:
         raise HTTPException(404, "Document not found")
@@ -181,16 +224,15 @@ def fetch_docs_html(id):
         filename = item.get("filename")
         pdf_blob_name = f"sell_item/{id}/{filename}"
         try:
-            # Assuming storage has a method to get the image bytes
-            pdf_bytes = storage.get_bytes(
+            stream = storage.open_stream(
                 bucket_name=ENV.GOOGLE_STORAGE_BUCKET, blob_name=pdf_blob_name
             )
-            if not pdf_bytes:
-                raise HTTPException(status_code=404, detail="PDF not found")
-            return StreamingResponse(
-                io.BytesIO(pdf_bytes), media_type="application/pdf"
-            )
+            return stream_response(stream, range_header, if_range, "application/pdf")
 
+        except NotFound:
+            raise HTTPException(status_code=404, detail="PDF not found")
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Failed to retrieve image: {e}"
@@ -200,18 +242,18 @@ def fetch_docs_html(id):
 
 
 @agent_rt.get("/sell/item/photo/{id}", status_code=status.HTTP_200_OK)
-async def get_profile_image(id):
+async def get_profile_image(
+    id,
+    w: Optional[int] = Query(None, ge=1),
+    fmt: Optional[str] = Query(None),
+    accept: Optional[str] = Header(None),
+):
 
     blob_name = f"sell_item/{id}/thumbnail.png"
     try:
-        image_bytes = storage.get_bytes(
-            bucket_name=ENV.GOOGLE_STORAGE_BUCKET, blob_name=blob_name
-        )
-
-        if not image_bytes:
-            raise HTTPException(status_code=404, detail="Profile image not found")
-
-        return StreamingResponse(io.BytesIO(image_bytes), media_type="image/png")
+        # Storage metadata calls block; keep them off the event loop
+        return await asyncio.to_thread(
+            image_response, blob_name, "image/png", "png", accept, w, fmt)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve image: {e}")
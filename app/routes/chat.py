@@ -1,60 +1,67 @@
 import asyncio
-import io
 import json
+from typing import Optional
 from fastapi import (
     APIRouter,
     Depends,
     File,
     HTTPException,
+    Header,
+    Query,
+    Response,
     UploadFile,
     WebSocket,
     WebSocketDisconnect,
 )
-from fastapi.responses import StreamingResponse
-from app.core import storage
-from app.utils.chat_manager import ConnectionManager, save_message
-from app.settings import ENV, logger
-from app.utils.image import compress_image
+from app.utils.chat_manager import chat_dispatcher, manager, presence, save_message
+from app.utils.message_buffer import message_buffer
+from app.settings import logger
+from app.utils.helper import ndjson_response, set_next_cursor
+from app.utils.renditions import image_response, save_image
 from app.utils.security import get_user_id
-from app.utils.notifications import notifier
+from app.utils.notifications import notifier, push_dispatcher, receipt_worker
 from app.core import redis
 from app.utils.call_manager import CallManager, CallRequestModel
 
 chat_rt = APIRouter(prefix="/chat", tags=["chat"])
 
 
-manager = ConnectionManager()
 call = CallManager()
 
 # WebSocket endpoint
 
 
 @chat_rt.get("/agent/history", status_code=200)
-def list_all_chat_agent(user_id=Depends(get_user_id)):
-    return manager.list_all_chat_agent()
+async def list_all_chat_agent(
+    response: Response,
+    user_id=Depends(get_user_id),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+):
+    chats, next_cursor = await manager.list_all_chat_agent(limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return chats
 
 
 @chat_rt.get("/user/history", status_code=200)
-def list_all_chat_user(user_id=Depends(get_user_id)):
-    return manager.user_chat_history(user_id)
+async def list_all_chat_user(user_id=Depends(get_user_id)):
+    return await manager.user_chat_history(user_id)
 
 
 @chat_rt.get("/image/{user_id}/{id}/{image_name}", status_code=200)
-def send_chat_image_frontend(user_id: str, id: str, image_name: str):
+def send_chat_image_frontend(
+    user_id: str,
+    id: str,
+    image_name: str,
+    w: Optional[int] = Query(None, ge=1),
+    fmt: Optional[str] = Query(None),
+    accept: Optional[str] = Header(None),
+):
 
     blob_name = f"chat/{user_id}/{id}/{image_name}"
 
     try:
-        # Assuming storage has a method to get the image bytes
-        image_bytes = storage.get_bytes(
-            bucket_name=ENV.GOOGLE_STORAGE_BUCKET, blob_name=blob_name
-        )
-
-        if not image_bytes:
-            raise HTTPException(status_code=404, detail="image not found")
-
-        # Return image bytes as StreamingResponse
-        return StreamingResponse(io.BytesIO(image_bytes), media_type="image/png")
+        return image_response(blob_name, "image/png", "compressed", accept, w, fmt)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve image: {e}")
@@ -79,24 +86,40 @@ async def save_chat_image_(
     if not image_bytes:
         raise HTTPException(status_code=400, detail="Uploaded image is empty")
 
-    compress_image_bytes = compress_image(image_bytes)
-
-    try:
-        public_url = storage.upload_bytes(
-            image_bytes=compress_image_bytes,
-            bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
-            blob_name=blob_name,
-            content_type="image/png",
-        )
-        if public_url:
-            return {"message": "image uploaded"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to upload image: {e}")
+    public_url = await save_image(
+        image_bytes, "compressed", blob_name=blob_name, content_type="image/png")
+    if public_url:
+        return {"message": "image uploaded"}
 
 
 @chat_rt.get("/request", status_code=200, response_model=list[CallRequestModel])
-def get_all_request():
-    return call.get_all_call_requests()
+def get_all_request(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
+    if stream:
+        return ndjson_response(call.stream_call_requests(cursor))
+    if limit is None:
+        return call.get_all_call_requests()
+    data, next_cursor = call.get_call_requests_page(limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return data
+
+
+@chat_rt.get("/metrics", status_code=200)
+def chat_metrics(user_id=Depends(get_user_id)):
+    return {
+        "connections": manager.status(),
+        "presence": presence.status(),
+        "writes": message_buffer.status(),
+        "push": {
+            **push_dispatcher.status(),
+            **receipt_worker.status(),
+            "context_cache": push_dispatcher.context.stats(),
+        },
+    }
 
 
 @chat_rt.get("/{id}", status_code=200, response_model=CallRequestModel)
@@ -120,21 +143,29 @@ async def chat(websocket: WebSocket, user_id: str, agent_id: str, role: str):
 
     socket_id = redis.generate_socket_id()
 
-    # 1) Register connection in Upstash
-    await redis.add_connected_user(sender_id, socket_id)
+    # 1) Register connection in Upstash (one pipelined round trip)
+    await presence.register(sender_id, socket_id)
 
     # 2) Register local WebSocket in this instance
     await manager.connect(websocket, doc_id, role)
     logger.info(f"{role} connected on instance with socket {socket_id}")
 
-    # 3) Start Pub/Sub listener for this websocket
-    asyncio.create_task(redis_subscriber(ENV.REDIS_CHANNEL_CHAT, doc_id))
+    # 3) Receive this conversation's messages published by other instances
+    await chat_dispatcher.watch(doc_id)
 
     try:
         while True:
             payload = await websocket.receive_json()
             logger.debug(f"Payload received: {payload}")
 
+            if payload.get("type") == "history":
+                # "Load older": page backwards from the cursor the client holds
+                history = await manager.send_chat_history(
+                    doc_id, before=payload.get("cursor")
+                )
+                await manager.send_json_data(websocket, {"type": "history", **history})
+                continue
+
             if payload.get("type") != "chat":
                 continue
             message = payload.get("message")
@@ -146,9 +177,9 @@ async def chat(websocket: WebSocket, user_id: str, agent_id: str, role: str):
             if message.get("type") == "call-request":
                 call_details = message.get("data")
                 logger.debug(f"Call request received: {call_details}")
-                call.initiate_call_request(**call_details)
+                await asyncio.to_thread(call.initiate_call_request, **call_details)
             # Save message (firestore or db)
-            save_message(doc_id, message)
+            message["message_id"] = await save_message(doc_id, message, role)
             asyncio.create_task(notifier.chat(user_id, role, agent_id, message))
 
             message["from_role"] = role
@@ -159,33 +190,18 @@ async def chat(websocket: WebSocket, user_id: str, agent_id: str, role: str):
             delivered_locally = await manager.send_to_role(doc_id, receiver, message)
 
             if not delivered_locally:
-                # 4) Receiver is not on this instance → publish globally
-                await redis.publish(ENV.REDIS_CHANNEL_CHAT, json.dumps(message))
+                # 4) Publish to the conversation: only instances holding one of
+                # its sockets are subscribed, so this is a no-op when the
+                # receiver is offline (they still get the push notification)
+                await redis.publish(
+                    chat_dispatcher.channel_for(doc_id), json.dumps(message)
+                )
 
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
-        await redis.remove_connected_user(user_id, socket_id)
+        await chat_dispatcher.unwatch(doc_id)
+        await presence.unregister(sender_id, socket_id)
         logger.info(f"{role} disconnected {socket_id}")
 
-
-async def redis_subscriber(channel: str, doc_id: str):
-    await redis.subscribe(channel)
-
-    async for msg in redis.listen():
-        if msg["type"] != "message":
-            continue
-
-        try:
-            data = json.loads(msg["data"])
-        except Exception:
-            continue
-
-        # Only messages for this conversation
-        if data.get("doc_id") != doc_id:
-            continue
-
-        sender = data.get("from_role")
-        receiver = "agent" if sender == "user" else "user"
-
-        # Deliver locally (if that role is connected on this instance)
-        await manager.send_to_role(doc_id, receiver, data)
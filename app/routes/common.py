@@ -1,13 +1,17 @@
+import asyncio
 from collections import deque
-import io
 import os
-from fastapi import APIRouter, Depends, File, HTTPException, Header, UploadFile, status
-from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import Optional
+from fastapi import APIRouter, Depends, File, HTTPException, Header, Query, UploadFile, status
+from fastapi.responses import PlainTextResponse
 
-from app.settings import ENV, TITLE, VERSION
-from app.core import storage, firebase
-from app.utils.security import get_user_id
-from app.utils.image import save_to_png
+from app.settings import TITLE, VERSION
+from app.core import db, firebase, redis
+from app.utils.catalog_manager import catalog
+from app.utils.chat_manager import presence
+from app.utils.security import get_user_id, token_cache
+from app.utils.image_processor import image_processor
+from app.utils.renditions import image_response, save_image
 
 
 common_rt = APIRouter(prefix="", tags=["common"])
@@ -46,29 +50,24 @@ async def upload_profile_image(
     if not image_bytes:
         raise HTTPException(status_code=400, detail="Uploaded image is empty")
 
-    thumbnail_image_bytes = save_to_png(image_bytes)
-
     blob_name = f"profile/{role}/{user_id}.png"
-    try:
-        public_url = storage.upload_bytes(
-            image_bytes=thumbnail_image_bytes,
-            bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
-            blob_name=blob_name,
-            content_type="image/png",
-        )
-        if public_url:
-            return {"message": "image uploaded"}
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Failed to upload image: {e}"
-        )
+    public_url = await save_image(
+        image_bytes, "png", blob_name=blob_name, content_type="image/png")
+    if public_url:
+        return {"message": "image uploaded"}
 
 
 @common_rt.get("/profile/photo", status_code=status.HTTP_200_OK)
 async def get_profile_image(user_id=Depends(get_user_id),
-                            role: str = Header("user", alias="X-Role")):
+                            role: str = Header("user", alias="X-Role"),
+                            w: Optional[int] = Query(None, ge=1),
+                            fmt: Optional[str] = Query(None),
+                            accept: Optional[str] = Header(None)):
     """
     Retrieve the profile image for the current user as image data.
+
+    `w` (display width in px) and `fmt` ("webp", "avif" or "original") or
+    the Accept header select a smaller/modern rendition when one exists.
     """
     if not user_id:
         raise HTTPException(
@@ -78,19 +77,9 @@ async def get_profile_image(user_id=Depends(get_user_id),
     blob_name = f"profile/{role}/{user_id}.png"
 
     try:
-        # Assuming storage has a method to get the image bytes
-        image_bytes = storage.get_bytes(
-            bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
-            blob_name=blob_name
-        )
-
-        if not image_bytes:
-            raise HTTPException(
-                status_code=404, detail="Profile image not found"
-            )
-
-        # Return image bytes as StreamingResponse
-        return StreamingResponse(io.BytesIO(image_bytes), media_type="image/png")
+        # Storage metadata calls block; keep them off the event loop
+        return await asyncio.to_thread(
+            image_response, blob_name, "image/png", "png", accept, w, fmt)
 
     except Exception as e:
         raise HTTPException(
@@ -113,6 +102,18 @@ async def read_logs():
             status_code=500, detail=f"Error reading log file: {str(e)}")
 
 
+@common_rt.get("/cache/stats")
+def cache_stats(user_id=Depends(get_user_id)):
+    return {
+        "documents": db.cache_stats(),
+        "catalog": catalog.status(),
+        "redis": redis.transport_stats(),
+        "presence": presence.status(),
+        "auth_tokens": token_cache.stats(),
+        "images": image_processor.status(),
+    }
+
+
 @common_rt.post("/protected")
 def protected_route(authorization: str = Header(None)):
     if not authorization:
@@ -1,9 +1,21 @@
-import io
+import asyncio
+import mimetypes
 from typing import List, Literal, Optional, Union
 import uuid
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
-from fastapi.responses import StreamingResponse
-from app.core import db, storage
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Header,
+    Query,
+    Response,
+    UploadFile,
+    status,
+)
+from google.api_core.exceptions import NotFound
+from app.core import async_db, db, storage
 from app.model.course_model import (
     CourseItem,
     CourseItemDB,
@@ -15,7 +27,9 @@ from app.model.course_model import (
     ItemInfoPayload,
 )
 from app.model.model import TableConfig
-from app.utils.image import compress_image, create_thumbnail_bytes
+from app.utils.catalog_manager import catalog
+from app.utils.helper import ndjson_response, paginate, set_next_cursor
+from app.utils.renditions import image_response, save_image
 from app.settings import ENV, logger
 from app.utils.security import get_user_id
 
@@ -39,13 +53,8 @@ async def add_course(
         try:
             blob_name = f"course/{id}/thumbnail.jpeg"
             image_bytes = await thumbnail.read()
-            thumbnail_image_bytes = create_thumbnail_bytes(image_bytes)
-            storage.upload_bytes(
-                image_bytes=thumbnail_image_bytes,
-                bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
-                blob_name=blob_name,
-                content_type="image/jpeg",
-            )
+            await save_image(
+                image_bytes, "thumbnail", blob_name=blob_name, content_type="image/jpeg")
         except Exception as e:
             logger.error(f"Error processing thumbnail: {e}")
 
@@ -54,10 +63,9 @@ async def add_course(
             for image in images:
                 blob_name = f"course/{id}/{image.filename}"
                 image_bytes = await image.read()
-                compressed_image_bytes = compress_image(image_bytes)
-                storage.upload_bytes(
-                    image_bytes=compressed_image_bytes,
-                    bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
+                await save_image(
+                    image_bytes,
+                    "compressed",
                     blob_name=blob_name,
                     content_type=str(image.content_type),
                 )
@@ -68,12 +76,13 @@ async def add_course(
     if pdf:
         try:
             blob_name = f"course/{id}/data.pdf"
-            pdf_bytes = await pdf.read()
-            storage.upload_bytes(
-                image_bytes=pdf_bytes,
+            await asyncio.to_thread(
+                storage.upload_stream,
+                pdf.file,
                 bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
                 blob_name=blob_name,
                 content_type="application/pdf",
+                size=pdf.size,
             )
         except Exception as e:
             logger.error(f"Error processing pdf: {e}")
@@ -87,7 +96,7 @@ async def add_course(
         course_type=course_type,
     )
 
-    db.add_data(TableConfig.COURSE_DATA.value, id, item.model_dump())
+    await async_db.add_data(TableConfig.COURSE_DATA.value, id, item.model_dump())
 
     return {"message": "Course added successfully"}
 
@@ -95,9 +104,24 @@ async def add_course(
 @course_rt.get(
     "/list", status_code=status.HTTP_200_OK, response_model=List[CourseItemDB]
 )
-def list_courses():
-    items = db.read_all_documents(TableConfig.COURSE_DATA.value)
-    return [CourseItemDB(**item) for item in items if item.get("course_type") == "pdf"]
+def list_courses(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
+    items = catalog.items(TableConfig.COURSE_DATA.value)
+    if stream:
+        return ndjson_response(
+            item
+            for item in items
+            if item.course_type == "pdf" and (cursor is None or item.id > cursor)
+        )
+    items, next_cursor = paginate(
+        [item for item in items if item.course_type == "pdf"], limit, cursor
+    )
+    set_next_cursor(response, next_cursor)
+    return items
 
 
 @course_rt.get("/content/{course_id}", status_code=status.HTTP_200_OK)
@@ -191,24 +215,19 @@ def delete_single_content(course_id: str, content_id: str):
 async def add_photo(course_id: str, image: UploadFile):
     blob_name = f"course/{course_id}/{image.filename}"
     image_bytes = await image.read()
-    compressed_image_bytes = compress_image(image_bytes)
-    storage.upload_bytes(
-        image_bytes=compressed_image_bytes,
-        bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
-        blob_name=blob_name,
-        content_type=str(image.content_type),
-    )
+    await save_image(
+        image_bytes, "compressed", blob_name=blob_name, content_type=str(image.content_type))
 
-    item = db.get_doc_ref(TableConfig.COURSE_DATA.value, course_id)
+    item = async_db.get_doc_ref(TableConfig.COURSE_DATA.value, course_id)
     if not item:
         raise HTTPException(status_code=404, detail="Course not found")
-    content = item.get().get("content")
+    content = (await item.get()).get("content")
     if not content:
         content = []
     content.append(
         ItemInfo(content_type="image", data=str(image.filename)).model_dump()
     )
-    item.update({"content": content})
+    await item.update({"content": content})
     return {"message": "Photo added successfully"}
 
 
@@ -216,12 +235,13 @@ async def add_photo(course_id: str, image: UploadFile):
 async def update_pdf(course_id: str, pdf: UploadFile):
     try:
         blob_name = f"course/{course_id}/data.pdf"
-        pdf_bytes = await pdf.read()
-        storage.upload_bytes(
-            image_bytes=pdf_bytes,
+        await asyncio.to_thread(
+            storage.upload_stream,
+            pdf.file,
             bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
             blob_name=blob_name,
             content_type="application/pdf",
+            size=pdf.size,
         )
         return {"message": "PDF updated successfully"}
     except Exception as e:
@@ -230,19 +250,29 @@ async def update_pdf(course_id: str, pdf: UploadFile):
 
 
 @course_rt.get("/file/{course_id}/{file_name}", status_code=status.HTTP_200_OK)
-async def get_profile_image(course_id, file_name):
+async def get_profile_image(
+    course_id,
+    file_name,
+    w: Optional[int] = Query(None, ge=1),
+    fmt: Optional[str] = Query(None),
+    accept: Optional[str] = Header(None),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+):
 
     blob_name = f"course/{course_id}/{file_name}"
     try:
-        file_bytes = storage.get_bytes(
-            bucket_name=ENV.GOOGLE_STORAGE_BUCKET, blob_name=blob_name
-        )
-
-        if not file_bytes:
-            raise HTTPException(status_code=404, detail="course file not found")
-
-        return StreamingResponse(io.BytesIO(file_bytes))
-
+        # Images may be served as a rendition; other files (the PDF) as stored
+        media_type, _ = mimetypes.guess_type(file_name)
+        kind = "thumbnail" if file_name == "thumbnail.jpeg" else "compressed"
+        # Storage metadata calls block; keep them off the event loop
+        return await asyncio.to_thread(
+            image_response, blob_name, media_type, kind, accept, w, fmt, range_header, if_range)
+
+    except NotFound:
+        raise HTTPException(status_code=404, detail="course file not found")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve file: {e}")
 
@@ -253,23 +283,27 @@ async def get_profile_image(course_id, file_name):
     status_code=status.HTTP_200_OK,
     response_model=List[CourseItemUserResponse],
 )
-def list__user_courses(user_id: str = Depends(get_user_id)):
-    items = db.read_all_documents(TableConfig.COURSE_DATA.value)
+def list__user_courses(
+    response: Response,
+    user_id: str = Depends(get_user_id),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+):
+    items = catalog.items(TableConfig.COURSE_DATA.value)
     if user_id is None:
-        return [CourseItemUserResponse(**item) for item in items if item["live"]]
-    user_ = db.read_data(TableConfig.USER.value, user_id)
-    if not user_:
-        raise HTTPException(status_code=404, detail="User not found")
-    active_courses = user_.get("subscriptions", {}).keys()
-    res = []
-    for item in items:
-        if item["id"] in active_courses:
-            item["active"] = True
-            res.append(CourseItemUserResponse(**item))
-        elif item["live"]:
-            item["active"] = False
-            res.append(CourseItemUserResponse(**item))
-    return res
+        active_courses = set()
+    else:
+        user_ = db.read_data(TableConfig.USER.value, user_id)
+        if not user_:
+            raise HTTPException(status_code=404, detail="User not found")
+        active_courses = user_.get("subscriptions", {}).keys()
+    visible = [item for item in items if item.id in active_courses or item.live]
+    page, next_cursor = paginate(visible, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return [
+        CourseItemUserResponse(**item.model_dump(), active=item.id in active_courses)
+        for item in page
+    ]
 
 
 ##--FARMING SUBSCRIPTION--##
@@ -284,8 +318,7 @@ def create_farming_subscription(data: FarmingSubscriptionCreate):
 
 @course_rt.get("/farming/subscription/list", status_code=status.HTTP_200_OK)
 def list_farming_courses():
-    items = db.read_all_documents(TableConfig.FarmingSubscriptionCourse.value)
-    return [FamingSubscriptionItemDB(**item) for item in items]
+    return list(catalog.items(TableConfig.FarmingSubscriptionCourse.value))
 
 
 @course_rt.put("/farming/subscription/live/{course_id}", status_code=status.HTTP_200_OK)
@@ -2,11 +2,11 @@ from datetime import datetime
 from typing import List, Literal, Optional
 from fastapi import APIRouter
 from pydantic import BaseModel, Field
-from app.core import db, redis
+from app.core import async_db, redis
 from app.model.model import TableConfig
 import httpx
 from app.settings import logger
-from app.utils.notifications import PushNotificationRequest, notifier
+from app.utils.notifications import PushNotificationRequest, notification_context, notifier
 
 notify_rt = APIRouter(prefix="/notification", tags=["notification"])
 
@@ -57,26 +57,27 @@ async def register_device(data: TokenRequest):
     # Using a Redis Set to automatically handle duplicate tokens for a user
     redis_key = f"expo_tokens:{data.user_id}"
     await redis.sadd(redis_key, data.expo_token)
+    notification_context.invalidate_tokens(data.user_id)
 
     # 2. Save device info into Firestore
-    doc_ref = db.get_doc_ref(TableConfig.DEVICE.value, data.user_id)
-    doc = doc_ref.get()
+    doc_ref = async_db.get_doc_ref(TableConfig.DEVICE.value, data.user_id)
+    doc = await doc_ref.get()
 
     device_data = data.device.model_dump()
     device_data["registered_at"] = data.request_date
 
     if doc.exists:
         # Document exists, update it
-        doc_ref.update(
+        await doc_ref.update(
             {
                 "last_active": data.request_date,
                 # Use array_union to avoid duplicates if the exact same device info is sent again
-                "devices": db.array_union([device_data]),
+                "devices": async_db.array_union([device_data]),
             }
         )
     else:
         # Document does not exist, create it
-        doc_ref.set({"last_active": data.request_date, "devices": [device_data]})
+        await doc_ref.set({"last_active": data.request_date, "devices": [device_data]})
 
     return {"message": "Device registered successfully"}
 
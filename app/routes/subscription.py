@@ -1,8 +1,9 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from datetime import datetime, timedelta, timezone
+from google.api_core.exceptions import NotFound
 from app.utils.security import get_user_id
-from app.core import db
+from app.core import async_db, db
 from app.utils.subs_manager import (
     SellItemSubscriptionResponse,
     Subscription,
@@ -12,6 +13,8 @@ from app.utils.subs_manager import (
     SubscriptionStatus,
     SubscriptionStatusResponse,
 )
+from app.utils.catalog_manager import catalog
+from app.utils.helper import ndjson_response, set_next_cursor
 from app.utils.razorpay_client import razorpay_client
 from app.model.model import SellItemUserResponse, TableConfig, UserResponse
 from app.settings import logger
@@ -19,6 +22,11 @@ from app.settings import logger
 
 subs_rt = APIRouter(prefix="/subscription", tags=["subscription"])
 
+FARMING_SUBSCRIBER_FILTER = [
+    ("farming_subs_expiry", ">", datetime(1970, 1, 1, tzinfo=timezone.utc))
+]
+FARMING_USER_FIELDS = ["id", "name", "email_id", "mobile_number", "farming_subs_expiry"]
+
 
 def create_subscription(
     data: SubscriptionCreate, user_id, price_paid, course_type="pdf"
@@ -80,7 +88,9 @@ def create_subscription(
             raise HTTPException(status_code=400, detail="Course already subscribed")
 
         subs_history[subscription.course_id] = subs_ref
-        user_doc_ref.set({"subscriptions": subs_history}, merge=True)
+        db.add_data(
+            TableConfig.USER.value, user_id, {"subscriptions": subs_history}, merge=True
+        )
         logger.debug("Course subscription created successfully")
     elif course_type == "farming":
         try:
@@ -93,7 +103,21 @@ def create_subscription(
                 status_code=400, detail="Farming subscription already active"
             )
 
-        user_doc_ref.set({"farming_subs_expiry": expiry_date}, merge=True)
+        db.add_data(
+            TableConfig.USER.value,
+            user_id,
+            {"farming_subs_expiry": expiry_date},
+            merge=True,
+        )
+        # Keep the chat inbox's denormalized subscriber flag in step. Users
+        # who never chatted have no conversation to update; their summary
+        # picks the expiry up from the User document on the first message
+        try:
+            db.get_doc_ref(TableConfig.CHAT.value, user_id).update(
+                {"subscription_expiry": expiry_date}
+            )
+        except NotFound:
+            pass
         logger.debug("Farming subscription created successfully")
 
     return subscription.course_id
@@ -136,9 +160,11 @@ def get_active_subscriptions(user_id: str = Depends(get_user_id)):
     if not active_courses:
         return course_details
 
-    for course_id, subs_ref in active_courses.items():
-        course = db.read_data(TableConfig.COURSE_DATA.value, course_id)
-        subs = db.get_document_ref(subs_ref.path).get().to_dict()
+    courses = db.read_many(TableConfig.COURSE_DATA.value, list(active_courses.keys()))
+    subscriptions = db.read_refs(
+        [db.get_document_ref(subs_ref.path) for subs_ref in active_courses.values()]
+    )
+    for course, subs in zip(courses, subscriptions):
         if not subs:
             continue
         if course:
@@ -152,32 +178,30 @@ def get_active_subscriptions(user_id: str = Depends(get_user_id)):
 
 @subs_rt.get("/sell/item", response_model=list[SellItemUserResponse])
 async def fetch_doc(user_id: str = Depends(get_user_id)):
-    items = db.read_all_documents(TableConfig.SELL_ITEM.name)
-    user_ = db.read_data(TableConfig.USER.value, user_id)
+    items = await catalog.items_async(TableConfig.SELL_ITEM.name)
+    user_ = await async_db.read_data(TableConfig.USER.value, user_id)
     if not user_:
         raise HTTPException(status_code=404, detail="User not found")
     active_courses = user_.get("subscriptions", {}).keys()
-    for item in items:
-        if item["id"] in active_courses:
-            item["active"] = True
 
-    return [SellItemUserResponse(**item) for item in items]
+    return [
+        SellItemUserResponse(**item.model_dump(), active=item.id in active_courses)
+        for item in items
+    ]
 
 
 @subs_rt.get("/course/{course_id}", response_model=list[UserResponse])
 async def get_all_user_courses(course_id: str):
-    courses = db.read_data_by_key_equal(
+    courses = await async_db.read_data_by_key_equal(
         TableConfig.SUBSCRIPTION.value, "course_id", course_id
     )
     if not courses:
         raise HTTPException(status_code=404, detail="Course not found")
 
-    user_res = []
-    for course in courses:
-        user = db.read_data(TableConfig.USER.value, course["user_id"])
-        user_res.append(UserResponse(**user))
-
-    return user_res
+    users = await async_db.read_many(
+        TableConfig.USER.value, [course["user_id"] for course in courses]
+    )
+    return [UserResponse(**user) for user in users if user]
 
 
 # @subs_rt.post("/farming/create")
@@ -195,16 +219,25 @@ def create_offline_subscription_farming(data: SubscriptionOfflineCreate, user_id
 
 
 @subs_rt.get("/farming/users", response_model=List[UserResponse])
-def fetch_users_farming_subscriptions():
-    # Fetch user data by mobile number
-    users = db.read_all_documents(TableConfig.USER.value)
-
-    if not users:
-        raise HTTPException(status_code=401, detail="No User found")
-    user_list = []
-    for user in users:
-        subs_expiry = user.get("farming_subs_expiry")
-        if subs_expiry:
-            user_list.append(UserResponse(**user))
-
-    return user_list
+def fetch_users_farming_subscriptions(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
+    # Only users that ever had a farming subscription, only the fields we return
+    query = dict(
+        filters=FARMING_SUBSCRIBER_FILTER,
+        select=FARMING_USER_FIELDS,
+        order_by="farming_subs_expiry",
+    )
+    if stream:
+        users = db.stream_query(TableConfig.USER.value, start_after=cursor, **query)
+        return ndjson_response(UserResponse(**user) for user in users)
+    if limit is None:
+        users = db.query(TableConfig.USER.value, start_after=cursor, **query)
+    else:
+        users, next_cursor = db.read_page(TableConfig.USER.value, limit, cursor, **query)
+        set_next_cursor(response, next_cursor)
+
+    return [UserResponse(**user) for user in users]
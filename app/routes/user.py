@@ -10,20 +10,25 @@ from app.model.model import (
     UserPsAuthResponse,
     UserResponse,
 )
-from app.settings import ENV
-from app.core import db
+from app.settings import ENV, logger
+from app.core import async_db, db
 from app.core import storage
-from app.utils.security import get_user_id, hash_password, verify_password
+from app.utils.security import (
+    get_user_id,
+    hash_password_async,
+    password_needs_rehash,
+    verify_password_async,
+)
 from app.utils.twilio_client import twilio_client
 
 user_rt = APIRouter(prefix="/user", tags=["user"])
 
 
 @user_rt.post("/pw/create", status_code=status.HTTP_201_CREATED)
-def create_user(payload: CreateUserRequest, role: str = Header("user", alias="X-Role")):
+async def create_user(payload: CreateUserRequest, role: str = Header("user", alias="X-Role")):
     # check for existing mobile
     table_Name = TableConfig[role.upper()].value
-    user = db.read_data_by_mobile(table_Name, payload.mobile_number)
+    user = await async_db.read_data_by_mobile(table_Name, payload.mobile_number)
     if user:
         raise HTTPException(status_code=400, detail="Mobile number already registered")
 
@@ -31,11 +36,11 @@ def create_user(payload: CreateUserRequest, role: str = Header("user", alias="X-
         id=str(uuid.uuid4()),
         name=payload.name,
         email_id=payload.email_id,
-        password_hash=hash_password(payload.password),
+        password_hash=await hash_password_async(payload.password),
         mobile_number=payload.mobile_number,
     ).model_dump()
 
-    db.add_data(table_Name, user_obj["id"], user_obj)
+    await async_db.add_data(table_Name, user_obj["id"], user_obj)
 
     return {"message": "user created"}
 
@@ -71,16 +76,28 @@ def verify_otp(
 
 
 @user_rt.post("/pw/auth")
-def authenticate(payload: AuthRequest, role: str = Header("user", alias="X-Role")):
-    user = db.read_data_by_mobile(
-        TableConfig[role.upper()].value, payload.mobile_number
-    )
+async def authenticate(payload: AuthRequest, role: str = Header("user", alias="X-Role")):
+    table_name = TableConfig[role.upper()].value
+    user = await async_db.read_data_by_mobile(table_name, payload.mobile_number)
     if not user:
         raise HTTPException(status_code=404, detail="user not found")
 
-    if not verify_password(user.get("password_hash", ""), payload.password):
+    stored_hash = user.get("password_hash", "")
+    if not await verify_password_async(stored_hash, payload.password):
         raise HTTPException(status_code=401, detail="invalid credentials")
 
+    if password_needs_rehash(stored_hash):
+        # Upgrade legacy or outdated hashes while the plain password is at hand
+        try:
+            await async_db.add_data(
+                table_name,
+                user["id"],
+                {"password_hash": await hash_password_async(payload.password)},
+                merge=True,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to rehash password of user {user.get('id')}: {e}")
+
     # Create JWT token
     token_data = UserPsAuthResponse(**user).model_dump()
     token = jwt.encode(token_data, ENV.SECRET_KEY, algorithm="HS256")
@@ -18,6 +18,79 @@ class EnvInit:
     REDIS_RESP_PORT = int(os.environ["REDIS_RESP_PORT"])
     REDIS_RESP_PASSWORD = os.environ["REDIS_RESP_PASSWORD"]
     REDIS_CHANNEL_CHAT = "chatMessage"
+    # "resp": KV/set/hash commands over the pooled RESP connection (HTTP on
+    # connection errors); "http": always use the Upstash REST API
+    REDIS_KV_TRANSPORT = os.getenv("REDIS_KV_TRANSPORT", "resp")
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+    # Websocket presence keys expire unless refreshed by a heartbeat
+    REDIS_PRESENCE_TTL = int(os.getenv("REDIS_PRESENCE_TTL", "90"))
+    # Identifies this process in presence keys; generated when empty
+    INSTANCE_ID = os.getenv("INSTANCE_ID", "")
+    # 0: one Pub/Sub channel per conversation; N: conversations hashed onto N channels
+    REDIS_CHAT_CHANNEL_SHARDS = int(os.getenv("REDIS_CHAT_CHANNEL_SHARDS", "0"))
+    # Messages sent on connect and per "load older" page
+    CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+    # Chat messages are written to Firestore in per-conversation batches
+    # this long after the first one arrives, or once the batch is full
+    CHAT_FLUSH_INTERVAL_MS = float(os.getenv("CHAT_FLUSH_INTERVAL_MS", "50"))
+    CHAT_FLUSH_MAX_BATCH = int(os.getenv("CHAT_FLUSH_MAX_BATCH", "100"))
+    CHAT_FLUSH_RETRIES = int(os.getenv("CHAT_FLUSH_RETRIES", "5"))
+    # Redis stream holding messages whose writes kept failing, replayed later
+    CHAT_SPILL_STREAM = os.getenv("CHAT_SPILL_STREAM", "chat:spill")
+    # Per-websocket outbound queue; on overflow "drop_oldest", "drop_newest" or "close"
+    CHAT_SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE", "100"))
+    CHAT_SEND_OVERFLOW = os.getenv("CHAT_SEND_OVERFLOW", "drop_oldest")
+    # Seconds one websocket send may take before the socket is closed
+    CHAT_SEND_TIMEOUT = float(os.getenv("CHAT_SEND_TIMEOUT", "10"))
+
+    # PBKDF2-SHA256 cost of new password hashes; older hashes are upgraded on login
+    PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "100000"))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+    # Worker processes for image decoding/encoding, and how many uploads may
+    # be running or waiting for one before new ones get 503
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+    IMAGE_MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", str(4 * IMAGE_WORKERS)))
+    # Resized copies stored next to each uploaded image ("webp", "avif");
+    # comma-separated widths in px, an empty format list disables them
+    IMAGE_RENDITION_WIDTHS = tuple(
+        int(w) for w in os.getenv("IMAGE_RENDITION_WIDTHS", "320,640,1280").split(",") if w.strip())
+    IMAGE_RENDITION_FORMATS = tuple(
+        f.strip() for f in os.getenv("IMAGE_RENDITION_FORMATS", "webp").split(",") if f.strip())
+    IMAGE_RENDITION_QUALITY = int(os.getenv("IMAGE_RENDITION_QUALITY", "80"))
+    # Uploads larger than this (bytes, or decoded pixels) are rejected with 413
+    IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+    IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "64000000"))
+    # Chat/course photos are stored scaled down to fit this many px per side
+    IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "2048"))
+    # Files are uploaded to Cloud Storage in resumable chunks of this many
+    # bytes (rounded down to a multiple of 256 KiB)
+    STORAGE_UPLOAD_CHUNK_SIZE = int(os.getenv("STORAGE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+    # Downloads are streamed to the client in ranged reads of this many bytes
+    STORAGE_DOWNLOAD_CHUNK_SIZE = int(os.getenv("STORAGE_DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    # Verified auth tokens are reused until they expire, at most this many seconds
+    AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+    AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+    FIRESTORE_CACHE_MAX_ENTRIES = int(os.getenv("FIRESTORE_CACHE_MAX_ENTRIES", "2048"))
+    # Seconds a cached User/AgentUser document may be served; 0 disables caching
+    FIRESTORE_CACHE_USER_TTL = float(os.getenv("FIRESTORE_CACHE_USER_TTL", "30"))
+    # How often dead catalog listeners are re-attached / catalogs re-read
+    CATALOG_POLL_INTERVAL = float(os.getenv("CATALOG_POLL_INTERVAL", "60"))
+
+    # Point both at a local fake server to exercise push delivery offline
+    EXPO_PUSH_URL = os.getenv("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+    EXPO_RECEIPTS_URL = os.getenv(
+        "EXPO_RECEIPTS_URL", "https://exp.host/--/api/v2/push/getReceipts")
+    # Receipts are checked once tickets are this old (Expo suggests ~15 minutes)
+    EXPO_RECEIPT_DELAY = float(os.getenv("EXPO_RECEIPT_DELAY", "900"))
+    EXPO_RECEIPT_INTERVAL = float(os.getenv("EXPO_RECEIPT_INTERVAL", "60"))
+    # Seconds recipient names and push tokens are reused by chat notifications
+    NOTIFY_CONTEXT_TTL = float(os.getenv("NOTIFY_CONTEXT_TTL", "300"))
+    # Chat pushes to one recipient within this many seconds become one push
+    PUSH_COALESCE_WINDOW = float(os.getenv("PUSH_COALESCE_WINDOW", "2"))
+    # Expo push requests in flight at once
+    PUSH_MAX_CONCURRENCY = int(os.getenv("PUSH_MAX_CONCURRENCY", "4"))
 
     RAZORPAY_KEY_ID = os.environ["RAZORPAY_KEY_ID"]
     RAZORPAY_KEY_SECRET = os.environ["RAZORPAY_KEY_SECRET"]
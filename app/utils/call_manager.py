@@ -3,6 +3,7 @@ from enum import Enum
 from typing import Optional
 from pydantic import BaseModel
 from app.core import db
+from app.core.db.query import InvalidCursor
 from app.model.model import TableConfig
 from app.settings import logger
 
@@ -99,6 +100,29 @@ class CallManager:
             logger.error(f"Error fetching call request: {e}")
             return {}
 
+    def get_call_requests_page(self, limit: int, cursor: Optional[str] = None):
+        """One page of call requests and the next cursor.
+
+        Errors propagate: an empty page would tell the client it has reached
+        the end, and an unknown cursor must become a 400 (InvalidCursor).
+        """
+        try:
+            data, next_cursor = db.read_page(
+                TableConfig.CALL_REQUEST.value, limit, cursor
+            )
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            logger.error(f"Error fetching call requests page: {e}")
+            raise
+        logger.debug("Call requests page fetched successfully")
+        return data, next_cursor
+
+    def stream_call_requests(self, cursor: Optional[str] = None):
+        """Lazily yield CallRequestModel objects, one Firestore document at a time."""
+        docs = db.stream_query(TableConfig.CALL_REQUEST.value, start_after=cursor)
+        return (CallRequestModel(**doc) for doc in docs)
+
     def get_all_call_requests(self):
         try:
             data = db.read_all_documents(TableConfig.CALL_REQUEST.value)
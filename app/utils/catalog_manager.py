@@ -0,0 +1,187 @@
+import asyncio
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from app.core import db
+from app.model.course_model import CourseItemDB, FamingSubscriptionItemDB
+from app.model.model import SellItem, TableConfig
+from app.settings import ENV, logger
+
+
+class CollectionSnapshot:
+    """In-memory, pre-validated copy of one Firestore collection.
+
+    Documents are validated into `model` once when they change, and readers
+    get an immutable tuple ordered by document id (the same order
+    `read_all_documents` returns), so listing endpoints are pure memory reads.
+    """
+
+    def __init__(self, collection_name: str, model: Type[BaseModel]):
+        self.collection_name = collection_name
+        self.model = model
+        self.watch = None
+        self.loaded = False
+        self.refreshed_at: Optional[datetime] = None
+        self._models: Dict[str, BaseModel] = {}
+        self._items: Tuple[BaseModel, ...] = ()
+        self._lock = threading.Lock()
+
+    def items(self) -> Tuple[BaseModel, ...]:
+        if not self.loaded:
+            # Startup load failed or hasn't happened yet: read once directly.
+            self.reload()
+        return self._items
+
+    def get(self, doc_id: str) -> Optional[BaseModel]:
+        if not self.loaded:
+            self.reload()
+        return self._models.get(doc_id)
+
+    def reload(self):
+        """Replace the snapshot with a full read of the collection."""
+        docs = db.read_raw_all_documents(self.collection_name)
+        models = {}
+        for doc in docs:
+            model = self._validate(doc.id, doc.to_dict())
+            if model is not None:
+                models[doc.id] = model
+        with self._lock:
+            self._models = models
+            self._publish()
+        logger.info(
+            f"Catalog '{self.collection_name}' loaded with {len(models)} items.")
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        """Firestore listener callback; runs on the watch's background thread."""
+        try:
+            with self._lock:
+                for change in changes:
+                    doc = change.document
+                    if change.type.name == "REMOVED":
+                        self._models.pop(doc.id, None)
+                        continue
+                    model = self._validate(doc.id, doc.to_dict())
+                    if model is None:
+                        self._models.pop(doc.id, None)
+                    else:
+                        self._models[doc.id] = model
+                self._publish()
+            logger.debug(
+                f"Catalog '{self.collection_name}' applied {len(changes)} change(s).")
+        except Exception as e:
+            logger.error(
+                f"Failed to apply snapshot for catalog '{self.collection_name}': {e}")
+
+    def _publish(self):
+        self._items = tuple(self._models[k] for k in sorted(self._models))
+        self.loaded = True
+        self.refreshed_at = datetime.now(timezone.utc)
+
+    def _validate(self, doc_id: str, data: dict) -> Optional[BaseModel]:
+        try:
+            return self.model(**data)
+        except ValidationError as e:
+            logger.warning(
+                f"Skipping invalid document '{doc_id}' in catalog '{self.collection_name}': {e}")
+            return None
+
+    @property
+    def listening(self) -> bool:
+        return self.watch is not None and getattr(self.watch, "is_active", False)
+
+    def listen(self):
+        self.unlisten()
+        self.watch = db.db.collection(self.collection_name).on_snapshot(
+            self._on_snapshot)
+
+    def unlisten(self):
+        if self.watch is not None:
+            try:
+                self.watch.unsubscribe()
+            except Exception as e:
+                logger.warning(
+                    f"Failed to stop listener for catalog '{self.collection_name}': {e}")
+            self.watch = None
+
+
+class CatalogManager:
+    """Keeps rarely-changing catalog collections in memory.
+
+    Each collection is loaded at startup and then kept fresh by a Firestore
+    `on_snapshot` listener. A background task re-attaches dead listeners and,
+    if that fails, falls back to re-reading the collection every
+    `poll_interval` seconds.
+    """
+
+    def __init__(self, poll_interval: float = 60.0):
+        self.poll_interval = poll_interval
+        self.snapshots: Dict[str, CollectionSnapshot] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, collection_name: str, model: Type[BaseModel]):
+        self.snapshots[collection_name] = CollectionSnapshot(collection_name, model)
+
+    def items(self, collection_name: str) -> Tuple[BaseModel, ...]:
+        return self.snapshots[collection_name].items()
+
+    def get(self, collection_name: str, doc_id: str) -> Optional[BaseModel]:
+        return self.snapshots[collection_name].get(doc_id)
+
+    async def items_async(self, collection_name: str) -> Tuple[BaseModel, ...]:
+        """items() for async handlers: a not yet loaded catalog is read on a
+        worker thread instead of blocking the event loop."""
+        snapshot = self.snapshots[collection_name]
+        if not snapshot.loaded:
+            await asyncio.to_thread(snapshot.reload)
+        return snapshot.items()
+
+    async def start(self):
+        for snapshot in self.snapshots.values():
+            try:
+                await asyncio.to_thread(snapshot.reload)
+                await asyncio.to_thread(snapshot.listen)
+            except Exception as e:
+                logger.error(
+                    f"Failed to start catalog '{snapshot.collection_name}': {e}")
+        self._task = asyncio.create_task(self._supervise())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for snapshot in self.snapshots.values():
+            await asyncio.to_thread(snapshot.unlisten)
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for snapshot in self.snapshots.values():
+                if snapshot.listening:
+                    continue
+                try:
+                    logger.warning(
+                        f"Catalog '{snapshot.collection_name}' listener is down; reloading.")
+                    await asyncio.to_thread(snapshot.reload)
+                    await asyncio.to_thread(snapshot.listen)
+                except Exception as e:
+                    logger.error(
+                        f"Failed to refresh catalog '{snapshot.collection_name}': {e}")
+
+    def status(self):
+        return {
+            name: {
+                "items": len(snapshot._items),
+                "listening": snapshot.listening,
+                "refreshed_at": snapshot.refreshed_at,
+            }
+            for name, snapshot in self.snapshots.items()
+        }
+
+
+catalog = CatalogManager(poll_interval=ENV.CATALOG_POLL_INTERVAL)
+catalog.register(TableConfig.COURSE_DATA.value, CourseItemDB)
+catalog.register(TableConfig.SELL_ITEM.name, SellItem)
+catalog.register(TableConfig.FarmingSubscriptionCourse.value, FamingSubscriptionItemDB)
@@ -1,88 +1,294 @@
+import asyncio
+import json
+import socket
+import time
+import uuid
+import zlib
+from collections import deque
 from datetime import datetime, timezone
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Set
 from fastapi import WebSocket
 
 from app.model.model import TableConfig
-from app.core import db
-from app.settings import logger
+from app.core import db, redis
+from app.settings import ENV, logger
+from app.utils.message_buffer import message_buffer
+from app.utils.message_store import message_store
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "close")
+
+# Close code sent when a client can't keep up with its outbound queue
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class SendMetrics:
+    """Counters and recent latencies of outbound websocket sends."""
+
+    def __init__(self, window: int = 1000):
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.closed_slow = 0
+        self.failed = 0
+        # seconds between enqueue and the end of send_json
+        self.latencies = deque(maxlen=window)
+
+    def observe(self, latency: float):
+        self.sent += 1
+        self.latencies.append(latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+        return {
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "closed_slow": self.closed_slow,
+            "failed": self.failed,
+            "send_latency_ms": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": percentile(1.0),
+            },
+        }
+
+
+class SocketWriter:
+    """Bounded outbound queue of one websocket, drained by its own task.
+
+    Producers (the peer's receive loop, the chat dispatcher) only enqueue,
+    so a slow client never blocks them. When the queue is full the
+    `overflow` policy applies: drop the oldest queued message, drop the new
+    one, or close the socket so the client reconnects and reloads history.
+    A send that takes longer than `send_timeout` also closes the socket.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        metrics: SendMetrics,
+        max_size: int = 100,
+        overflow: str = "drop_oldest",
+        send_timeout: float = 10.0,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy '{overflow}', expected one of {OVERFLOW_POLICIES}")
+        self.websocket = websocket
+        self.metrics = metrics
+        self.overflow = overflow
+        self.send_timeout = send_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.closed = False
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    @property
+    def alive(self) -> bool:
+        """False once the writer is closing or stopped; it delivers nothing more."""
+        return not self.closed and not self._task.done()
+
+    def send(self, data: Any) -> bool:
+        """Queue `data` for sending; False if it was dropped."""
+        if self.closed:
+            return False
+        item = (time.monotonic(), data)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.overflow == "close":
+                self.metrics.closed_slow += 1
+                logger.warning("Outbound queue full, closing slow websocket")
+                self.close(WS_CLOSE_TRY_AGAIN_LATER)
+                return False
+            self.metrics.dropped += 1
+            if self.overflow == "drop_newest":
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(item)
+        self.metrics.enqueued += 1
+        return True
+
+    async def _run(self):
+        while True:
+            queued_at, data = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_json(data), self.send_timeout)
+                self.metrics.observe(time.monotonic() - queued_at)
+            except asyncio.TimeoutError:
+                self.metrics.closed_slow += 1
+                logger.warning(f"Websocket send exceeded {self.send_timeout}s, closing")
+                self.close(WS_CLOSE_TRY_AGAIN_LATER)
+                return
+            except Exception as e:
+                # Socket is gone; the receive loop will notice and disconnect
+                self.metrics.failed += 1
+                logger.debug(f"Websocket send failed: {e}")
+                self.closed = True
+                return
+
+    def close(self, code: int):
+        self.stop()
+        asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def stop(self):
+        """Stop the writer without touching the socket; queued messages are dropped."""
+        self.closed = True
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
 
 # Connection manager for private chats
 
 
 class ConnectionManager:
-    def __init__(self):
-        # key: doc_id, value: {"user": ws, "agent": ws}
-        self.active_chats: Dict[str, Dict[str, WebSocket]] = {}
+    def __init__(
+        self,
+        queue_size: int = 100,
+        overflow: str = "drop_oldest",
+        send_timeout: float = 10.0,
+    ):
+        # key: doc_id, value: {"user": writer, "agent": writer}
+        self.active_chats: Dict[str, Dict[str, SocketWriter]] = {}
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.send_timeout = send_timeout
+        self.metrics = SendMetrics()
 
     async def connect(self, websocket: WebSocket, doc_id: str, role: str):
         await websocket.accept()
         if doc_id not in self.active_chats:
             self.active_chats[doc_id] = {}
-        self.active_chats[doc_id][role] = websocket
-        previous_chat = db.read_data(TableConfig.CHAT.value, doc_id)
-        await websocket.send_json(previous_chat)
+        previous = self.active_chats[doc_id].get(role)
+        if previous:
+            # Same role reconnected; the old socket no longer receives messages
+            previous.stop()
+        writer = SocketWriter(
+            websocket, self.metrics, self.queue_size, self.overflow, self.send_timeout
+        )
+        self.active_chats[doc_id][role] = writer
+        writer.send(await self.send_chat_history(doc_id))
+        if role == "agent":
+            await message_store.mark_read(doc_id)
 
     def disconnect(self, websocket: WebSocket):
         for doc_id, roles in list(self.active_chats.items()):
-            for role, ws in roles.items():
-                if ws == websocket:
+            for role, writer in roles.items():
+                if writer.websocket == websocket:
+                    writer.stop()
                     del roles[role]
                     if not roles:
                         del self.active_chats[doc_id]
                     return
 
+    def local_roles(self, doc_id: str) -> Dict[str, SocketWriter]:
+        """Sockets of `doc_id` held by this instance, keyed by role."""
+        return self.active_chats.get(doc_id, {})
+
     async def send_json_data(self, websocket: WebSocket, data: Any):
+        for roles in self.active_chats.values():
+            for writer in roles.values():
+                if writer.websocket == websocket:
+                    writer.send(data)
+                    return
         await websocket.send_json(data)
 
     async def send_to_role(self, doc_id: str, role: str, message: dict):
+        """Queue `message` for the role's local socket.
+
+        True when a live socket is held by this instance, even if the
+        overflow policy dropped the message: publishing it elsewhere wouldn't
+        help. False when there is none or its writer is closing (overflow
+        "close", send timeout, failed send), so the caller falls back.
+        """
         chat = self.active_chats.get(doc_id)
         if not chat:
             return False
 
-        websocket = chat.get(role)
-        if websocket:
-            await websocket.send_json(message)
-            return True
+        writer = chat.get(role)
+        if writer and writer.alive:
+            writer.send(message)
+            return writer.alive
 
         return False
 
-    async def send_chat_history(self, doc_id: str):
-        return db.read_data(TableConfig.CHAT.value, doc_id)
+    def status(self) -> Dict[str, Any]:
+        depths = [
+            writer.depth for roles in self.active_chats.values() for writer in roles.values()
+        ]
+        return {
+            "sockets": len(depths),
+            "queue_size": self.queue_size,
+            "overflow": self.overflow,
+            "queue_depth": {
+                "total": sum(depths),
+                "max": max(depths, default=0),
+            },
+            **self.metrics.snapshot(),
+        }
+
+    async def send_chat_history(self, doc_id: str, before: Optional[str] = None):
+        """Latest page of messages, or the page preceding the `before` cursor."""
+        messages, cursor = await message_buffer.recent(doc_id, before=before)
+        return {"messages": messages, "cursor": cursor}
 
-    def user_chat_history(self, user_id: str):
-        his = db.read_data(TableConfig.CHAT.value, user_id)
-        if not his:
-            logger.debug("No chat history found for user: ", user_id)
+    async def user_chat_history(self, user_id: str):
+        messages, cursor = await message_buffer.recent(user_id)
+        if not messages:
+            logger.debug(f"No chat history found for user: {user_id}")
             return []
         return {
             "id": user_id,
             "userName": "Assistant",
-            "lastMessage": his.get("messages")[-1].get("text"),
-            "all": his.get("messages"),
+            "lastMessage": messages[-1].get("text"),
+            "all": messages,
+            "cursor": cursor,
         }
 
-    def list_all_chat_agent(self):
-        all_chat = db.read_raw_all_documents(TableConfig.CHAT.value)
+    async def list_all_chat_agent(
+        self, limit: Optional[int] = None, cursor: Optional[str] = None
+    ):
+        """Agent inbox, most recent conversation first, from the summary documents."""
+        summaries, next_cursor = await message_store.inbox_page(limit, cursor)
+        now = datetime.now(timezone.utc)
 
         chat_response = []
-        for chat in all_chat:
-            try:
-                subs_status, name = self.get_user_name(chat.id)
-                chat_response.append(
-                    {
-                        "id": chat.id,
-                        "userName": name,
-                        "subscriber": subs_status,
-                        "lastMessage": chat._data.get("messages")[-1].get("text"),
-                        "all": chat._data.get("messages")[:50],
-                    }
-                )
-            except:
-                pass
-        return chat_response
+        for summary in summaries:
+            subs_expiry = summary.get("subscription_expiry")
+            chat_response.append(
+                {
+                    "id": summary.get("id"),
+                    "userName": summary.get("user_name", "User"),
+                    "subscriber": bool(subs_expiry and subs_expiry > now),
+                    "lastMessage": summary.get("last_message"),
+                    "lastMessageAt": summary.get("last_message_at"),
+                    "lastFromRole": summary.get("last_from_role"),
+                    "unreadCount": summary.get("unread_count", 0),
+                }
+            )
+        return chat_response, next_cursor
 
     def get_user_name(self, user_id: str):
         user = db.read_data(TableConfig.USER.value, user_id)
+        return self.user_summary(user)
+
+    @staticmethod
+    def user_summary(user: Optional[dict]):
         if user:
             subs_expiry = user.get("farming_subs_expiry")
             if subs_expiry:
@@ -94,6 +300,169 @@ class ConnectionManager:
 
 
 # Save message with timestamp
-def save_message(doc_id: str, message: dict):
-    db.append_data(TableConfig.CHAT.value, doc_id, message)
-    return
+async def save_message(doc_id: str, message: dict, role: str = "user"):
+    return await message_buffer.save(doc_id, message, role)
+
+
+class ChatDispatcher:
+    """Single Redis Pub/Sub reader per process for chat fan-out.
+
+    Each published message is decoded once and routed through the
+    ConnectionManager's doc_id index, instead of every websocket running its
+    own listener. Messages travel on per-conversation channels (or, with
+    `shards` > 0, on one of `shards` hashed channels) and this instance only
+    subscribes to channels of conversations it holds a socket for.
+    Started and stopped with the app.
+    """
+
+    def __init__(self, manager: ConnectionManager, prefix: str, shards: int = 0):
+        self.manager = manager
+        self.prefix = prefix
+        self.shards = shards
+        # channel -> local doc_ids that need it
+        self._channels: Dict[str, Set[str]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def channel_for(self, doc_id: str) -> str:
+        if self.shards > 0:
+            return f"{self.prefix}:shard:{zlib.crc32(doc_id.encode()) % self.shards}"
+        return f"{self.prefix}:{doc_id}"
+
+    async def watch(self, doc_id: str):
+        """Subscribe to `doc_id`'s channel when its first local socket connects."""
+        channel = self.channel_for(doc_id)
+        async with self._lock:
+            doc_ids = self._channels.setdefault(channel, set())
+            if not doc_ids:
+                await redis.subscribe(channel)
+                logger.debug(f"Subscribed to '{channel}'")
+            doc_ids.add(doc_id)
+
+    async def unwatch(self, doc_id: str):
+        """Unsubscribe once no local socket needs the channel any more."""
+        if self.manager.local_roles(doc_id):
+            return
+        channel = self.channel_for(doc_id)
+        async with self._lock:
+            doc_ids = self._channels.get(channel)
+            if doc_ids is None:
+                return
+            doc_ids.discard(doc_id)
+            if not doc_ids:
+                del self._channels[channel]
+                await redis.unsubscribe(channel)
+                logger.debug(f"Unsubscribed from '{channel}'")
+
+    async def start(self):
+        # Created here so it binds to the running loop (Python 3.9)
+        self._lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Chat dispatcher started for '{self.prefix}:*' channels")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        async with self._lock:
+            channels = list(self._channels)
+            self._channels.clear()
+        if channels:
+            try:
+                await redis.unsubscribe(*channels)
+            except Exception as e:
+                logger.warning(f"Failed to unsubscribe chat channels: {e}")
+
+    async def _run(self):
+        backoff = 1
+        while True:
+            try:
+                async for msg in redis.listen():
+                    backoff = 1
+                    await self.dispatch(msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Chat dispatcher error, retrying in {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    async def dispatch(self, raw: str):
+        try:
+            data = json.loads(raw)
+        except Exception:
+            return
+
+        doc_id = data.get("doc_id")
+        if not self.manager.local_roles(doc_id):
+            # No socket for this conversation on this instance
+            return
+
+        sender = data.get("from_role")
+        receiver = "agent" if sender == "user" else "user"
+        try:
+            await self.manager.send_to_role(doc_id, receiver, data)
+        except Exception as e:
+            logger.warning(f"Failed to deliver message for '{doc_id}': {e}")
+
+
+class PresenceTracker:
+    """Registry of which instance holds each user's websockets.
+
+    Sockets are registered in Redis under this process' `instance_id`, and
+    one heartbeat task refreshes every local socket in a single pipelined
+    request, so keys of a crashed instance simply expire.
+    """
+
+    def __init__(self, ttl: int, instance_id: str = ""):
+        self.interval = max(ttl / 3, 1)
+        self.instance_id = instance_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        # socket_id -> user_id for sockets held by this instance
+        self.sockets: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def register(self, user_id: str, socket_id: str):
+        self.sockets[socket_id] = user_id
+        await redis.add_connected_user(user_id, socket_id, self.instance_id)
+
+    async def unregister(self, user_id: str, socket_id: str):
+        self.sockets.pop(socket_id, None)
+        await redis.remove_connected_user(user_id, socket_id)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Presence heartbeat started for instance '{self.instance_id}'")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await redis.refresh_connected_users(dict(self.sockets), self.instance_id)
+            except Exception as e:
+                logger.warning(f"Presence heartbeat failed: {e}")
+
+    def status(self):
+        return {
+            "instance_id": self.instance_id,
+            "local_sockets": len(self.sockets),
+        }
+
+
+manager = ConnectionManager(
+    queue_size=ENV.CHAT_SEND_QUEUE_SIZE,
+    overflow=ENV.CHAT_SEND_OVERFLOW,
+    send_timeout=ENV.CHAT_SEND_TIMEOUT,
+)
+presence = PresenceTracker(ENV.REDIS_PRESENCE_TTL, instance_id=ENV.INSTANCE_ID)
+chat_dispatcher = ChatDispatcher(
+    manager, ENV.REDIS_CHANNEL_CHAT, shards=ENV.REDIS_CHAT_CHANNEL_SHARDS
+)
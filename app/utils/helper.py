@@ -1,4 +1,8 @@
 import re
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
 
 
 def extract_google_docs_id(url: str) -> str:
@@ -13,3 +17,105 @@ def extract_google_docs_id(url: str) -> str:
     if not match:
         raise ValueError("Invalid Google Docs URL: Document ID not found.")
     return match.group(1)
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def paginate(items, limit=None, cursor=None, key=lambda item: item.id):
+    """
+    Cursor pagination over an in-memory list already sorted by `key`.
+
+    Returns (page, next_cursor); next_cursor is None on the last page.
+    """
+    if cursor is not None:
+        items = [item for item in items if key(item) > cursor]
+    if limit is None:
+        return list(items), None
+    page = list(items[:limit])
+    next_cursor = key(page[-1]) if len(items) > limit else None
+    return page, next_cursor
+
+
+def set_next_cursor(response, next_cursor):
+    """Expose the next page cursor without changing list response bodies."""
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def ndjson_response(models):
+    """
+    Stream pydantic models as newline-delimited JSON, one line per model.
+
+    `models` may be a lazy (sync or async) iterable, so only one document is
+    held in memory at a time and the first line is sent as soon as it's ready.
+    """
+    if hasattr(models, "__aiter__"):
+        async def body():
+            async for model in models:
+                yield model.model_dump_json() + "\n"
+    else:
+        def body():
+            for model in models:
+                yield model.model_dump_json() + "\n"
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Resolve a single `Range: bytes=...` header to inclusive (start, end).
+
+    Returns None (serve the whole body) for a missing, malformed or
+    multi-range header; raises 416 when the range lies beyond the end.
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header or "")
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+        if last and end < start:
+            return None
+    else:
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    if start >= size or end < start:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, min(end, size - 1)
+
+
+def stream_response(stream, range_header=None, if_range=None, media_type=None, headers=None):
+    """
+    Stream an opened blob (StorageManager.open_stream) chunk by chunk.
+
+    Honors a single byte range with 206 Partial Content, unless `If-Range`
+    names another version of the blob, so PDF viewers and media players
+    can seek without downloading the whole file.
+    """
+    headers = {
+        **(headers or {}),
+        "Accept-Ranges": "bytes",
+    }
+    etag = f'"{stream.etag}"' if stream.etag else None
+    if etag:
+        headers["ETag"] = etag
+    byte_range = None
+    if not if_range or if_range == etag:
+        byte_range = parse_range(range_header, stream.size)
+    media_type = media_type or stream.content_type
+    if byte_range is None:
+        headers["Content-Length"] = str(stream.size)
+        return StreamingResponse(stream.chunks(), media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{stream.size}"
+    return StreamingResponse(
+        stream.chunks(start, end), status_code=206, media_type=media_type, headers=headers)
@@ -1,39 +1,124 @@
 import io
-from PIL import Image
-from fastapi import HTTPException
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
 
+from PIL import ExifTags, Image, ImageOps, features
 
-def save_to_png(image_bytes, max_size=(500, 500), thumbnail=True):
-    # Open image with Pillow
+# These functions run in ImageProcessor's worker processes (see
+# app/utils/image_processor.py): keep them module-level and their errors
+# picklable, and don't import app.core or app.settings here, or every worker
+# would create its own Firestore/Storage/Redis clients.
+
+# Rendition format -> (Pillow format, content type), in order of preference
+RENDITION_FORMATS = {
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+# Uploads with more pixels than this are rejected before being decoded
+MAX_PIXELS = 64_000_000
+
+# EXIF orientations that rotate the image by 90 degrees
+_SWAPPED_ORIENTATIONS = (5, 6, 7, 8)
+
+Box = Tuple[int, int]
+
+
+class ImageError(ValueError):
+    """The upload could not be decoded or processed."""
+
+
+class ImageTooLarge(ImageError):
+    """The upload exceeds the allowed size in bytes or pixels."""
+
+
+def worker_ready() -> int:
+    """No-op job used to spawn the image workers ahead of the first upload."""
+    return os.getpid()
+
+
+def supported_formats(formats: Iterable[str]) -> Tuple[str, ...]:
+    """The rendition formats in `formats` this Pillow build can encode."""
+    return tuple(
+        fmt for fmt in RENDITION_FORMATS if fmt in formats and features.check(fmt)
+    )
+
+
+def _open(image_bytes: bytes, max_pixels: Optional[int] = MAX_PIXELS) -> Image.Image:
+    """Read the image header only, rejecting images above `max_pixels`."""
     try:
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            # Convert image to RGB if needed (for JPEG, PNG)
-            if img.mode in ("RGBA", "P"):
-                img = img.convert("RGB")
-
-            # Resize or compress for profile picture (optional, e.g., max 500x500)
-            if thumbnail:
-                img.thumbnail(max_size)
-
-            # Save as PNG to bytes
-            output_bytes_io = io.BytesIO()
-            img.save(output_bytes_io, format="PNG", optimize=True)
-            return output_bytes_io.getvalue()
+        img = Image.open(io.BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(f"Image is too large: {e}")
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to process image: {e}")
+        raise ImageError(f"Failed to process image: {e}")
+    width, height = img.size
+    if max_pixels and width * height > max_pixels:
+        img.close()
+        raise ImageTooLarge(
+            f"Image is too large: {width}x{height} px, at most {max_pixels} px allowed")
+    return img
 
 
-# Compress the image
-def compress_image(image_bytes: bytes, quality: int = 85) -> bytes:
-    """
-    Compress image but keep original extension / format.
+def _load(img: Image.Image, box: Optional[Box] = None):
+    """Decode the pixels; JPEGs at the smallest 1/2-1/8 scale still covering `box`.
+
+    `box` is the upright (width, height) the largest output needs.
     """
+    try:
+        if box:
+            if img.getexif().get(ExifTags.Base.Orientation) in _SWAPPED_ORIENTATIONS:
+                box = box[::-1]
+            img.draft(None, box)
+        img.load()
+    except Exception as e:
+        raise ImageError(f"Failed to process image: {e}")
+
+
+def _orient(img: Image.Image):
+    """Apply the EXIF orientation so outputs are upright (keeps img.format)."""
+    try:
+        ImageOps.exif_transpose(img, in_place=True)
+    except Exception as e:
+        raise ImageError(f"Failed to process image: {e}")
+
+
+def _decode(
+    image_bytes: bytes, box: Optional[Box] = None, max_pixels: Optional[int] = MAX_PIXELS
+) -> Image.Image:
+    img = _open(image_bytes, max_pixels)
+    _load(img, box)
+    _orient(img)
+    return img
+
+
+def _png(img: Image.Image, max_size=(500, 500), thumbnail=True) -> bytes:
+    # Convert image to RGB if needed (for JPEG, PNG)
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    else:
+        img = img.copy()
+
+    # Resize or compress for profile picture (optional, e.g., max 500x500)
+    if thumbnail:
+        img.thumbnail(max_size)
 
-    image = Image.open(io.BytesIO(image_bytes))
+    # Save as PNG to bytes
+    output_bytes_io = io.BytesIO()
+    img.save(output_bytes_io, format="PNG", optimize=True)
+    return output_bytes_io.getvalue()
 
+
+def _compressed(image: Image.Image, quality: int = 85, max_dimension: Optional[int] = None) -> bytes:
     original_format = image.format  # JPG, JPEG, PNG, WEBP, etc.
     output_buffer = io.BytesIO()
 
+    if max_dimension and max(image.size) > max_dimension:
+        # thumbnail() works in place and `image` may be shared with renditions
+        image = image.copy()
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
     # Convert unsupported modes
     if image.mode in ("RGBA", "P") and original_format in ["JPEG", "JPG"]:
         image = image.convert("RGB")
@@ -65,6 +150,43 @@ def compress_image(image_bytes: bytes, quality: int = 85) -> bytes:
     return output_buffer.getvalue()
 
 
+def _thumbnail(img: Image.Image, size=(200, 200), quality=85) -> bytes:
+    # Convert unsupported modes
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    else:
+        img = img.copy()
+
+    # Resize while preserving aspect ratio
+    img.thumbnail(size, Image.Resampling.LANCZOS)
+
+    output_buffer = io.BytesIO()
+
+    img.save(output_buffer, format="JPEG", quality=quality, optimize=True)
+
+    return output_buffer.getvalue()
+
+
+def save_to_png(image_bytes, max_size=(500, 500), thumbnail=True):
+    with _decode(image_bytes, max_size if thumbnail else None) as img:
+        try:
+            return _png(img, max_size, thumbnail)
+        except Exception as e:
+            raise ImageError(f"Failed to process image: {e}")
+
+
+# Compress the image
+def compress_image(image_bytes: bytes, quality: int = 85, max_dimension: Optional[int] = None) -> bytes:
+    """
+    Compress image but keep original extension / format.
+
+    With `max_dimension`, larger images are also scaled down to fit it.
+    """
+    box = (max_dimension, max_dimension) if max_dimension else None
+    with _decode(image_bytes, box) as image:
+        return _compressed(image, quality, max_dimension)
+
+
 def create_thumbnail_bytes(image_bytes: bytes, size=(200, 200), quality=85) -> bytes:
     """
     Create a thumbnail and return it as bytes.
@@ -74,18 +196,118 @@ def create_thumbnail_bytes(image_bytes: bytes, size=(200, 200), quality=85) -> b
     :param quality: JPEG quality
     :return: Image bytes
     """
+    with _decode(image_bytes, size) as img:
+        return _thumbnail(img, size, quality)
 
-    img = Image.open(io.BytesIO(image_bytes))
 
-    # Convert unsupported modes
-    if img.mode in ("RGBA", "P"):
-        img = img.convert("RGB")
+def renditions(
+    img: Image.Image, widths: Iterable[int], formats: Iterable[str], quality: int = 80
+) -> Dict[Tuple[int, str], bytes]:
+    """Encode `img` at each width (never upscaled) in each rendition format.
 
-    # Resize while preserving aspect ratio
-    img.thumbnail(size, Image.Resampling.LANCZOS)
+    Smaller widths are resized from the previous, larger one, and widths at
+    or above the source width share one encoding.
+    """
+    if img.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in img.mode or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    result: Dict[Tuple[int, str], bytes] = {}
+    encoded: Dict[Tuple[int, str], bytes] = {}
+    current = img
+    for width in sorted(set(widths), reverse=True):
+        if width < current.width:
+            height = max(1, round(current.height * width / current.width))
+            current = current.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for fmt in formats:
+            key = (current.width, fmt)
+            if key not in encoded:
+                output_buffer = io.BytesIO()
+                current.save(output_buffer, format=RENDITION_FORMATS[fmt][0], quality=quality)
+                encoded[key] = output_buffer.getvalue()
+            result[(width, fmt)] = encoded[key]
+    return result
 
-    output_buffer = io.BytesIO()
 
-    img.save(output_buffer, format="JPEG", quality=quality, optimize=True)
+# Box the primary blob of fixed-size upload kinds is fitted into
+PRIMARY_BOXES = {
+    "png": (500, 500),
+    "thumbnail": (200, 200),
+}
 
-    return output_buffer.getvalue()
+
+def rendition_widths(
+    kind: str, widths: Iterable[int], max_dimension: Optional[int] = None
+) -> Tuple[int, ...]:
+    """The rendition widths stored for an upload of `kind`, ascending.
+
+    Renditions stand in for the primary blob, so none is wider than it:
+    configured widths above the primary's largest width are dropped. That
+    width itself is always included; since renditions are never upscaled,
+    it holds a copy at the primary's own size (the largest one, served by
+    default).
+    """
+    widths = sorted(set(widths))
+    cap = PRIMARY_BOXES[kind][0] if kind in PRIMARY_BOXES else max_dimension
+    if not cap or not widths:
+        return tuple(widths)
+    return tuple([width for width in widths if width < cap] + [cap])
+
+
+def _primary(kind: str, max_dimension: Optional[int]):
+    """(encoder, box it needs) for the primary blob of an upload of `kind`."""
+    if kind == "png":
+        return _png, PRIMARY_BOXES["png"]
+    if kind == "thumbnail":
+        return _thumbnail, PRIMARY_BOXES["thumbnail"]
+    if kind == "compressed":
+        box = (max_dimension, max_dimension) if max_dimension else None
+        return (lambda img: _compressed(img, max_dimension=max_dimension)), box
+    raise ImageError(f"Unknown image kind '{kind}'")
+
+
+def process_upload(
+    image_bytes: bytes,
+    kind: str,
+    widths: Iterable[int] = (),
+    formats: Iterable[str] = (),
+    quality: int = 80,
+    max_pixels: Optional[int] = MAX_PIXELS,
+    max_dimension: Optional[int] = None,
+) -> Tuple[bytes, Dict[Tuple[int, str], bytes], Dict[str, float]]:
+    """Decode an upload once and return (primary bytes, renditions, timings).
+
+    `kind` is "png" (500px profile PNG), "thumbnail" (200px JPEG) or
+    "compressed" (re-encoded in its own format, scaled to fit
+    `max_dimension`). Renditions are keyed by (width, format), with widths
+    from rendition_widths(), and are never larger than the primary blob;
+    JPEGs are decoded at the smallest scale that still covers every output.
+    Timings are milliseconds per stage.
+    """
+    timings: Dict[str, float] = {}
+    encode, box = _primary(kind, max_dimension)
+    widths = rendition_widths(kind, widths, max_dimension) if formats else ()
+    if box and widths:
+        box = (max(box[0], max(widths)), box[1])
+
+    start = time.perf_counter()
+    img = _open(image_bytes, max_pixels)
+    with img:
+        _load(img, box)
+        timings["decode"] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        _orient(img)
+        timings["orient"] = (time.perf_counter() - start) * 1000
+        try:
+            start = time.perf_counter()
+            primary = encode(img)
+            timings["primary"] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            source = img
+            if kind in PRIMARY_BOXES and widths:
+                source = img.copy()
+                source.thumbnail(PRIMARY_BOXES[kind], Image.Resampling.LANCZOS)
+            result = renditions(source, widths, formats, quality)
+            timings["renditions"] = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            raise ImageError(f"Failed to process image: {e}")
+    return primary, result, timings
@@ -0,0 +1,131 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from app.settings import ENV, logger
+from app.utils.image import ImageError, ImageTooLarge, worker_ready
+
+
+class ImageProcessor:
+    """Runs Pillow work from app.utils.image on a pool of worker processes.
+
+    Decoding and encoding are CPU-bound and hold the GIL, so they run in
+    `max_workers` processes instead of on the event loop. At most
+    `max_pending` jobs are admitted (running plus waiting); beyond that
+    uploads are rejected with 503 so a burst can't pile up unbounded
+    memory. Workers are spawned, not forked, because the parent holds
+    gRPC (Firestore) threads that don't survive a fork; they only import
+    app.utils.image, so the app must be built under run.py's main guard.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 8):
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+        # Worker-side time per processing stage (decode, orient, encode...)
+        self.stage_ms: Dict[str, float] = {}
+        self.stage_counts: Dict[str, int] = {}
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    async def start(self):
+        self.executor = self._new_executor()
+        # Spawn the workers now rather than on the first upload
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(
+                *(loop.run_in_executor(self.executor, worker_ready) for _ in range(self.max_workers)))
+            logger.info(f"Image processor started with {self.max_workers} workers")
+        except Exception as e:
+            logger.error(f"Failed to start image workers: {e}")
+
+    async def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run `func(*args)` on a worker; processing errors become HTTP 400
+        (413 for images over the size limits)."""
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Image processing is busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.in_flight += 1
+        start = time.perf_counter()
+        executor = self.executor
+        try:
+            if executor is None:
+                # Not started (e.g. scripts): keep the loop free with a thread
+                result = await asyncio.to_thread(func, *args)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(executor, func, *args)
+            self.processed += 1
+            return result
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed for memory); later jobs get a fresh pool
+            self.failed += 1
+            # Every job on the broken pool lands here; only the first replaces
+            # it, so jobs already submitted to the new pool aren't cancelled
+            if self.executor is executor and executor is not None:
+                logger.error(f"Image worker pool broke, restarting it: {e}")
+                self.executor = self._new_executor()
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise HTTPException(status_code=503, detail="Image processing failed, please retry")
+        except ImageTooLarge as e:
+            self.failed += 1
+            logger.warning(f"Image rejected by {func.__name__}: {e}")
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Image processing with {func.__name__} failed: {e}")
+            detail = str(e) if isinstance(e, ImageError) else f"Failed to process image: {e}"
+            raise HTTPException(status_code=400, detail=detail)
+        finally:
+            self.in_flight -= 1
+            self.busy_seconds += time.perf_counter() - start
+
+    def record_stages(self, timings: Dict[str, float]):
+        """Add one job's per-stage timings (ms) to the running averages."""
+        for stage, ms in timings.items():
+            self.stage_ms[stage] = self.stage_ms.get(stage, 0.0) + ms
+            self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+
+    def status(self) -> Dict[str, Any]:
+        done = self.processed + self.failed
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.max_workers),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_ms": round(self.busy_seconds / done * 1000, 2) if done else None,
+            "stage_avg_ms": {
+                stage: round(ms / self.stage_counts[stage], 2)
+                for stage, ms in self.stage_ms.items()
+            },
+        }
+
+
+image_processor = ImageProcessor(
+    max_workers=ENV.IMAGE_WORKERS, max_pending=ENV.IMAGE_MAX_PENDING
+)
@@ -0,0 +1,212 @@
+import asyncio
+import json
+from typing import Dict, List, Optional, Tuple
+
+from app.core import redis
+from app.settings import ENV, logger
+from app.utils.message_store import MIGRATION_BATCH_SIZE, MessageStore, message_store
+
+
+class MessageBuffer:
+    """Write-behind buffer in front of MessageStore.
+
+    `save` assigns the message id and returns at once, so the message can be
+    delivered before Firestore is involved. A background task then writes
+    each conversation's pending messages (and one summary update) in a single
+    batch, `flush_interval` seconds after the first one arrived or as soon as
+    `max_batch` are waiting.
+
+    A failed batch is retried with exponential backoff; after `retries`
+    attempts its messages are appended to the Redis stream `spill_stream`
+    and replayed into Firestore on the next start or after the next clean
+    flush. Everything still pending is flushed on shutdown.
+
+    `recent` merges this instance's pending messages into history reads.
+    Messages pending on another instance (for up to `flush_interval`) and
+    spilled ones (until replayed) are not visible to history reads; they
+    still reach live receivers through delivery.
+    """
+
+    def __init__(
+        self,
+        store: MessageStore,
+        flush_interval: float = 0.05,
+        max_batch: int = 100,
+        retries: int = 5,
+        spill_stream: str = "chat:spill",
+    ):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_batch = min(max_batch, MIGRATION_BATCH_SIZE)
+        self.retries = retries
+        self.spill_stream = spill_stream
+        # doc_id -> [(message, role)] not yet committed, in send order
+        self.pending: Dict[str, List[Tuple[dict, str]]] = {}
+        self.flushed = 0
+        self.retried = 0
+        self.spilled = 0
+        self.replayed = 0
+        self._has_spill = True  # check the stream on the first flush
+        # Created in start(): on Python 3.9 they bind to the loop current at creation
+        self._arrived: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def save(self, doc_id: str, message: dict, role: str = "user") -> str:
+        if self._task is None:
+            # Not running (e.g. scripts): write through
+            return await self.store.save(doc_id, message, role)
+        message_id, data = self.store.build_message(message)
+        entries = self.pending.setdefault(doc_id, [])
+        entries.append((data, role))
+        self._arrived.set()
+        if len(entries) >= self.max_batch:
+            self._full.set()
+        return message_id
+
+    async def recent(
+        self, doc_id: str, limit: Optional[int] = None, before: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """MessageStore.recent plus this instance's not yet written messages."""
+        messages, cursor = await self.store.recent(doc_id, limit, before)
+        if before is None and self.pending.get(doc_id):
+            stored = {message.get("message_id") for message in messages}
+            messages.extend(
+                data for data, _ in self.pending[doc_id] if data["message_id"] not in stored
+            )
+        return messages, cursor
+
+    async def start(self):
+        self._stopping = False
+        self._arrived = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        # First pass replays anything spilled by a previous run
+        self._arrived.set()
+        logger.info(
+            f"Chat write-behind started (every {self.flush_interval}s or {self.max_batch} messages)")
+
+    async def stop(self):
+        """Finish the current flush, then write everything still pending."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._arrived.set()
+        self._full.set()
+        await self._task
+        self._task = None
+        await self.flush()
+        if self.pending:
+            logger.error(
+                f"Chat write-behind stopped with {sum(map(len, self.pending.values()))} unsaved messages")
+
+    async def _run(self):
+        while not self._stopping:
+            await self._arrived.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._arrived.clear()
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Chat write-behind flush failed: {e}")
+
+    async def flush(self):
+        doc_ids = [doc_id for doc_id, entries in self.pending.items() if entries]
+        results = await asyncio.gather(*(self._flush_doc(doc_id) for doc_id in doc_ids))
+        if self._has_spill and all(results):
+            try:
+                await self.replay()
+            except Exception as e:
+                logger.error(f"Failed to replay spilled chat messages: {e}")
+
+    async def _flush_doc(self, doc_id: str) -> bool:
+        """Write `doc_id`'s pending messages; False if they had to be spilled."""
+        clean = True
+        while self.pending.get(doc_id):
+            entries = self.pending[doc_id][: self.max_batch]
+            if not await self._write(doc_id, entries):
+                clean = False
+                try:
+                    await self._spill(doc_id, entries)
+                except Exception as e:
+                    # Keep them pending; the next flush tries again
+                    logger.error(f"Failed to spill messages of conversation '{doc_id}': {e}")
+                    return False
+            del self.pending[doc_id][: len(entries)]
+        self.pending.pop(doc_id, None)
+        return clean
+
+    async def _write(self, doc_id: str, entries: List[Tuple[dict, str]]) -> bool:
+        delay = 0.1
+        for attempt in range(1, self.retries + 1):
+            try:
+                await self.store.save_many(doc_id, entries)
+                self.flushed += len(entries)
+                return True
+            except Exception as e:
+                if attempt == self.retries:
+                    break
+                self.retried += 1
+                logger.warning(
+                    f"Retrying write of conversation '{doc_id}' in {delay}s "
+                    f"(attempt {attempt}/{self.retries}): {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+        return False
+
+    async def _spill(self, doc_id: str, entries: List[Tuple[dict, str]]):
+        for data, role in entries:
+            await redis.xadd(
+                self.spill_stream,
+                {"doc_id": doc_id, "role": role, "message": json.dumps(data, default=str)},
+            )
+        self.spilled += len(entries)
+        self._has_spill = True
+        logger.warning(
+            f"Spilled {len(entries)} messages of conversation '{doc_id}' to '{self.spill_stream}'")
+
+    async def replay(self):
+        """Write spilled messages to Firestore and remove them from the stream.
+
+        Replayed messages are usually older than what has been saved since,
+        so they go through MessageStore.replay_many, which leaves a newer
+        summary alone.
+        """
+        while True:
+            entries = await redis.xrange(self.spill_stream, count=self.max_batch)
+            if not entries:
+                break
+            by_doc: Dict[str, List[Tuple[str, dict, str]]] = {}
+            for entry_id, fields in entries:
+                by_doc.setdefault(fields["doc_id"], []).append(
+                    (entry_id, json.loads(fields["message"]), fields["role"]))
+            for doc_id, items in by_doc.items():
+                await self.store.replay_many(doc_id, [(data, role) for _, data, role in items])
+                await redis.xdel(self.spill_stream, *[entry_id for entry_id, _, _ in items])
+                self.replayed += len(items)
+            logger.info(f"Replayed {len(entries)} spilled chat messages")
+        self._has_spill = False
+
+    def status(self):
+        return {
+            "pending": sum(len(entries) for entries in self.pending.values()),
+            "conversations": len(self.pending),
+            "flushed": self.flushed,
+            "retried": self.retried,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+        }
+
+
+message_buffer = MessageBuffer(
+    message_store,
+    flush_interval=ENV.CHAT_FLUSH_INTERVAL_MS / 1000,
+    max_batch=ENV.CHAT_FLUSH_MAX_BATCH,
+    retries=ENV.CHAT_FLUSH_RETRIES,
+    spill_stream=ENV.CHAT_SPILL_STREAM,
+)
@@ -0,0 +1,308 @@
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from google.cloud import firestore
+
+from app.core import async_db
+from app.core.db.query import DOCUMENT_ID
+from app.model.model import TableConfig
+from app.settings import ENV, logger
+
+MESSAGES_SUBCOLLECTION = "messages"
+
+INBOX_FIELDS = [
+    "id",
+    "last_message",
+    "last_message_at",
+    "last_from_role",
+    "unread_count",
+    "user_name",
+    "subscription_expiry",
+]
+
+# Firestore allows 500 writes per batch; leave room for the parent update
+MIGRATION_BATCH_SIZE = 400
+
+
+def new_message_id(sent_at_ms: Optional[int] = None) -> str:
+    """Time-ordered message id: document id order == send order."""
+    sent_at_ms = sent_at_ms if sent_at_ms is not None else int(time.time() * 1000)
+    return f"{sent_at_ms:013d}-{uuid.uuid4().hex[:8]}"
+
+
+def legacy_message_id(index: int) -> str:
+    """Deterministic id for a migrated array message.
+
+    Sorts before every new_message_id() and keeps the original array order,
+    so re-running a migration overwrites instead of duplicating.
+    """
+    return f"{0:013d}-{index:08d}"
+
+
+class MessageStore:
+    """Chat history stored as one document per message.
+
+    Messages live in `ChatHistory/{doc_id}/messages/{message_id}` with
+    time-ordered ids, so the latest N messages and "load older" pages are
+    plain id-ordered queries. The parent `ChatHistory/{doc_id}` document is
+    the conversation's inbox summary (see INBOX_FIELDS), denormalized on
+    every save so the agent inbox never reads messages or User documents.
+    """
+
+    def __init__(self, collection_name: str, page_size: int = 50):
+        self.collection_name = collection_name
+        self.page_size = page_size
+
+    def messages_path(self, doc_id: str) -> str:
+        return f"{self.collection_name}/{doc_id}/{MESSAGES_SUBCOLLECTION}"
+
+    def build_message(self, message: dict) -> Tuple[str, dict]:
+        sent_at_ms = int(time.time() * 1000)
+        message_id = new_message_id(sent_at_ms)
+        return message_id, {**message, "message_id": message_id, "sent_at_ms": sent_at_ms}
+
+    def summary_update(
+        self,
+        doc_id: str,
+        message: dict,
+        role: str,
+        user: Optional[dict] = None,
+        unread: int = 1,
+    ) -> dict:
+        """Inbox fields to merge into the parent document after `message`.
+
+        Messages from the user count as unread for the agent; an agent reply
+        means the conversation has been read. `unread` is the number of user
+        messages being saved together (after the last agent reply, if any).
+        `last_message_at` is when the message was sent, not when it's written.
+        """
+        sent_at_ms = message.get("sent_at_ms")
+        summary = {
+            "id": doc_id,
+            "last_message": message.get("text"),
+            "last_message_at": (
+                datetime.fromtimestamp(sent_at_ms / 1000, timezone.utc)
+                if sent_at_ms else datetime.now(timezone.utc)
+            ),
+            "last_from_role": role,
+            "unread_count": firestore.Increment(unread) if role == "user" else 0,
+        }
+        if user:
+            summary.update(self.user_fields(user))
+        return summary
+
+    @staticmethod
+    def user_fields(user: dict) -> dict:
+        return {
+            "user_name": user.get("name", "User"),
+            "subscription_expiry": user.get("farming_subs_expiry"),
+        }
+
+    def _batch_summary(
+        self, doc_id: str, entries: List[Tuple[dict, str]], user: Optional[dict]
+    ) -> dict:
+        """summary_update() for the last of `entries`, counting trailing user messages."""
+        last_message, last_role = entries[-1]
+        unread = 0
+        for _, role in reversed(entries):
+            if role != "user":
+                break
+            unread += 1
+        summary = self.summary_update(doc_id, last_message, last_role, user, unread)
+        if unread and unread < len(entries):
+            # An agent reply in this batch reset the counter before these messages
+            summary["unread_count"] = unread
+        return summary
+
+    async def save(self, doc_id: str, message: dict, role: str = "user") -> str:
+        """Write one message and refresh the conversation summary atomically."""
+        message_id, data = self.build_message(message)
+        await self.save_many(doc_id, [(data, role)])
+        return message_id
+
+    async def save_many(self, doc_id: str, entries: List[Tuple[dict, str]]):
+        """Write built messages of one conversation and its summary in one batch.
+
+        `entries` are (message from build_message, role) in send order and
+        must fit in a single batch (at most MIGRATION_BATCH_SIZE).
+        """
+        if not entries:
+            return
+        # Conversations are keyed by the user's id; served from the User cache
+        user = await async_db.read_data(TableConfig.USER.value, doc_id)
+        summary = self._batch_summary(doc_id, entries, user)
+        try:
+            batch = async_db.db.batch()
+            messages_ref = async_db.db.collection(self.messages_path(doc_id))
+            for data, _ in entries:
+                batch.set(messages_ref.document(data["message_id"]), data)
+            batch.set(
+                async_db.get_doc_ref(self.collection_name, doc_id),
+                summary,
+                merge=True,
+            )
+            await batch.commit()
+            logger.debug(f"{len(entries)} message(s) saved in conversation '{doc_id}'.")
+        except Exception as e:
+            logger.error(f"Failed to save messages in conversation '{doc_id}': {e}")
+            raise
+
+    async def replay_many(self, doc_id: str, entries: List[Tuple[dict, str]]):
+        """Write messages of one conversation that are being saved late.
+
+        Newer messages may have been saved in the meantime, so the summary
+        only moves forward: it is updated from the replayed messages sent
+        after its `last_message_at`, if any, in the same transaction that
+        writes the message documents.
+        """
+        if not entries:
+            return
+        user = await async_db.read_data(TableConfig.USER.value, doc_id)
+        doc_ref = async_db.get_doc_ref(self.collection_name, doc_id)
+        messages_ref = async_db.db.collection(self.messages_path(doc_id))
+
+        @firestore.async_transactional
+        async def write(transaction):
+            snapshot = await doc_ref.get(field_paths=["last_message_at"], transaction=transaction)
+            last_at = (snapshot.to_dict() or {}).get("last_message_at") if snapshot.exists else None
+            last_ms = int(last_at.timestamp() * 1000) if last_at else -1
+            for data, _ in entries:
+                transaction.set(messages_ref.document(data["message_id"]), data)
+            newer = [(data, role) for data, role in entries if data.get("sent_at_ms", 0) > last_ms]
+            if newer:
+                transaction.set(doc_ref, self._batch_summary(doc_id, newer, user), merge=True)
+
+        try:
+            await write(async_db.db.transaction())
+            logger.debug(f"{len(entries)} message(s) replayed in conversation '{doc_id}'.")
+        except Exception as e:
+            logger.error(f"Failed to replay messages in conversation '{doc_id}': {e}")
+            raise
+
+    async def recent(
+        self, doc_id: str, limit: Optional[int] = None, before: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Return (messages oldest→newest, cursor for older messages or None).
+
+        Without `before` this is the latest page; pass the returned cursor
+        back as `before` to load the page preceding it.
+        """
+        limit = limit or self.page_size
+        messages, cursor = await async_db.read_page(
+            self.messages_path(doc_id), limit, before, order_by="-" + DOCUMENT_ID
+        )
+        if not messages and before is None and await self.migrate_legacy(doc_id):
+            messages, cursor = await async_db.read_page(
+                self.messages_path(doc_id), limit, order_by="-" + DOCUMENT_ID
+            )
+        messages.reverse()
+        return messages, cursor
+
+    async def inbox_page(
+        self, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Conversation summaries, most recent first.
+
+        Only the summary fields are transferred, so legacy message arrays
+        that haven't been migrated yet are never read here.
+        """
+        query = dict(select=INBOX_FIELDS, order_by="-last_message_at")
+        if limit is None:
+            summaries = await async_db.query(
+                self.collection_name, start_after=cursor, **query
+            )
+            return summaries, None
+        return await async_db.read_page(self.collection_name, limit, cursor, **query)
+
+    async def mark_read(self, doc_id: str):
+        """Reset the unread counter once the agent opens the conversation."""
+        await async_db.add_data(
+            self.collection_name, doc_id, {"unread_count": 0}, merge=True
+        )
+
+    async def refresh_summary(self, doc_id: str):
+        """Rebuild the denormalized user fields of one conversation's summary."""
+        user = await async_db.read_data(TableConfig.USER.value, doc_id)
+        summary = {"id": doc_id, **(self.user_fields(user) if user else {})}
+        await async_db.add_data(self.collection_name, doc_id, summary, merge=True)
+
+    async def migrate_legacy(self, doc_id: str) -> int:
+        """Move a legacy `messages` array into the subcollection.
+
+        Returns the number of migrated messages (0 if there was nothing to do).
+        The array field is only removed once every batch has been committed.
+        """
+        doc_ref = async_db.get_doc_ref(self.collection_name, doc_id)
+        snapshot = await doc_ref.get()
+        legacy = (snapshot.to_dict() or {}).get("messages") if snapshot.exists else None
+        if not legacy:
+            return 0
+
+        messages_ref = async_db.db.collection(self.messages_path(doc_id))
+        try:
+            for start in range(0, len(legacy), MIGRATION_BATCH_SIZE):
+                batch = async_db.db.batch()
+                for index in range(start, min(start + MIGRATION_BATCH_SIZE, len(legacy))):
+                    message_id = legacy_message_id(index)
+                    batch.set(
+                        messages_ref.document(message_id),
+                        {**legacy[index], "message_id": message_id},
+                    )
+                await batch.commit()
+
+            summary = {"messages": firestore.DELETE_FIELD}
+            if not (snapshot.to_dict() or {}).get("last_message_at"):
+                summary["last_message"] = legacy[-1].get("text")
+                summary["last_message_at"] = snapshot.update_time
+            await doc_ref.update(summary)
+            await self.refresh_summary(doc_id)
+            logger.info(
+                f"Migrated {len(legacy)} messages of conversation '{doc_id}' to subcollection.")
+            return len(legacy)
+        except Exception as e:
+            logger.error(f"Failed to migrate conversation '{doc_id}': {e}")
+            raise
+
+    async def backfill_inbox(self) -> int:
+        """Give every conversation an inbox position.
+
+        The inbox is ordered by `last_message_at`, and Firestore leaves out
+        documents without that field, so legacy conversations would stay
+        invisible to agents until the user opened them. Only the summary
+        fields are read to find them; each one is then migrated, which sets
+        the timestamp. Returns the number of migrated messages.
+        """
+        migrated = 0
+        query = async_db.db.collection(self.collection_name).select(["last_message_at"])
+        try:
+            async for snapshot in query.stream():
+                if (snapshot.to_dict() or {}).get("last_message_at"):
+                    continue
+                try:
+                    migrated += await self.migrate_legacy(snapshot.id)
+                except Exception:
+                    # Logged by migrate_legacy; the conversation migrates on first read
+                    continue
+        except Exception as e:
+            logger.error(f"Inbox backfill failed: {e}")
+        if migrated:
+            logger.info(f"Inbox backfill migrated {migrated} legacy chat messages.")
+        return migrated
+
+    async def migrate_all_legacy(self) -> int:
+        """Migrate every conversation that still stores a messages array and
+        backfill inbox summaries that predate them."""
+        migrated = 0
+        async for snapshot in async_db.db.collection(self.collection_name).stream():
+            data = snapshot.to_dict() or {}
+            if "messages" in data:
+                migrated += await self.migrate_legacy(snapshot.id)
+            elif "user_name" not in data and data.get("last_message_at"):
+                await self.refresh_summary(snapshot.id)
+        logger.info(f"Chat history migration finished: {migrated} messages moved.")
+        return migrated
+
+
+message_store = MessageStore(TableConfig.CHAT.value, page_size=ENV.CHAT_HISTORY_PAGE_SIZE)
@@ -1,12 +1,23 @@
-from typing import Any, Literal, Optional
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Literal, Optional, Set, Tuple
 from fastapi import HTTPException
 import httpx
 from pydantic import BaseModel
-from app.core import db, redis
+from app.core import async_db, redis
+from app.core.cache import TTLCache
 from app.model.model import TableConfig
-from app.settings import logger
+from app.settings import ENV, logger
 
-EXPO_PUSH_URL = "https://exp.host/--/api/v2/push/send"
+# Expo accepts at most 100 messages per push request and 1000 receipt ids
+EXPO_MAX_BATCH = 100
+EXPO_MAX_RECEIPT_IDS = 1000
+# Expo keeps receipts for 24 hours
+EXPO_RECEIPT_TTL = 24 * 60 * 60
+
+# (recipient user_id, Expo message)
+PushEntry = Tuple[str, dict]
 
 
 class PushNotificationRequest(BaseModel):
@@ -16,8 +27,388 @@ class PushNotificationRequest(BaseModel):
     data: Optional[dict] = None
 
 
+def is_expo_token(token: str) -> bool:
+    return token.startswith("ExponentPushToken[") or token.startswith("ExpoPushToken[")
+
+
+class NotificationContext:
+    """Recipient data needed by every chat push, cached for `ttl` seconds.
+
+    Holds each user's display name and already-validated device tokens, so
+    steady-state chat notifications make no Firestore or Redis reads.
+    Token entries are invalidated on this instance when a device registers
+    or a token is pruned; other instances pick changes up after `ttl`.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 4096):
+        self.cache = TTLCache(max_entries=max_entries, default_ttl=ttl)
+
+    async def tokens(self, user_id: str) -> Tuple[str, ...]:
+        key = ("tokens", user_id)
+        tokens = self.cache.get(key)
+        if tokens is None:
+            version = self.cache.version(key)
+            tokens = []
+            for token in await redis.smembers(f"expo_tokens:{user_id}"):
+                # Basic validation for Expo token format
+                if is_expo_token(token):
+                    tokens.append(token)
+                else:
+                    logger.warning(f"Invalid push token format for user {user_id}: {token}")
+            tokens = tuple(tokens)
+            self.cache.set(key, tokens, version=version)
+        return tokens
+
+    async def user_name(self, user_id: str) -> str:
+        key = ("name", user_id)
+        name = self.cache.get(key)
+        if name is None:
+            version = self.cache.version(key)
+            user = await async_db.read_data(TableConfig.USER.value, user_id)
+            name = user.get("name") if user else "User"
+            self.cache.set(key, name, version=version)
+        return name
+
+    def invalidate_tokens(self, user_id: str):
+        self.cache.invalidate(("tokens", user_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+
+class PushDispatcher:
+    """Delivers Expo push notifications through one long-lived HTTP client.
+
+    `notify` coalesces per recipient: the first notification opens a
+    `coalesce_window`, later ones inside it only bump a counter, and the
+    recipient gets a single push ("3 new messages"). Released notifications
+    become one Expo message per device token on a shared queue, which the
+    sender packs into requests of up to EXPO_MAX_BATCH messages across
+    recipients, with at most `max_concurrency` requests in flight.
+    """
+
+    def __init__(
+        self,
+        push_url: str,
+        context: NotificationContext,
+        coalesce_window: float = 2.0,
+        max_concurrency: int = 4,
+        timeout: float = 10.0,
+    ):
+        self.push_url = push_url
+        self.context = context
+        self.coalesce_window = coalesce_window
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.client: Optional[httpx.AsyncClient] = None
+        # user_id -> (latest request, notifications folded into it)
+        self._pending: Dict[str, Tuple[PushNotificationRequest, int]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        # Set to a ReceiptWorker to follow up on the tickets of every request
+        self.receipts: Optional["ReceiptWorker"] = None
+        self.coalesced = 0
+        self.requests = 0
+        self.sent = 0
+        self.failed = 0
+
+    def _client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+            )
+        return self.client
+
+    async def start(self):
+        self._client()
+        self._queue = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Send everything coalesced or queued, then close the client."""
+        for user_id in list(self._timers):
+            self._timers.pop(user_id).cancel()
+            await self._release(user_id)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        remaining = []
+        while self._queue is not None and not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        try:
+            await self._send_entries(remaining)
+        except Exception as e:
+            logger.error(f"Failed to send {len(remaining)} queued push messages: {e}")
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def build_messages(self, request: PushNotificationRequest) -> List[dict]:
+        return self.messages_for(request, await self.context.tokens(request.user_id))
+
+    @staticmethod
+    def messages_for(request: PushNotificationRequest, tokens: List[str]) -> List[dict]:
+        """One Expo message per valid device token of the recipient."""
+        messages = []
+        for token in tokens:
+            # Basic validation for Expo token format
+            if is_expo_token(token):
+                messages.append(
+                    {
+                        "to": token,
+                        "sound": "default",
+                        "title": request.title,
+                        "body": request.body,
+                        "data": request.data or {},
+                    }
+                )
+            else:
+                logger.warning(
+                    f"Invalid push token format for user {request.user_id}: {token}"
+                )
+        return messages
+
+    async def notify(self, request: PushNotificationRequest):
+        """Queue a push for `request.user_id`, folding bursts into one."""
+        if self._task is None:
+            # Not started (e.g. scripts): deliver right away
+            await self.send(await self.build_messages(request), request.user_id)
+            return
+        user_id = request.user_id
+        entry = self._pending.get(user_id)
+        if entry:
+            self._pending[user_id] = (request, entry[1] + 1)
+            self.coalesced += 1
+            return
+        self._pending[user_id] = (request, 1)
+        self._timers[user_id] = asyncio.get_running_loop().call_later(
+            self.coalesce_window, self._schedule_release, user_id
+        )
+
+    def _schedule_release(self, user_id: str):
+        # Tracked so stop() waits for it before draining the queue
+        task = asyncio.create_task(self._release(user_id))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _release(self, user_id: str):
+        self._timers.pop(user_id, None)
+        entry = self._pending.pop(user_id, None)
+        if entry is None:
+            return
+        request, count = entry
+        if count > 1:
+            request = request.model_copy(update={"body": f"{count} new messages"})
+        try:
+            for message in await self.build_messages(request):
+                self._queue.put_nowait((user_id, message))
+        except Exception as e:
+            logger.error(f"Failed to queue push notification for user {user_id}: {e}")
+
+    async def _run(self):
+        while True:
+            # Take a slot before dequeuing, so a batch taken off the queue is
+            # always handed to _post (stop() drains only the queue). Waiting
+            # here also lets the queue fill up, so bursts go out in full batches
+            await self._semaphore.acquire()
+            try:
+                batch = [await self._queue.get()]
+            except asyncio.CancelledError:
+                self._semaphore.release()
+                raise
+            while len(batch) < EXPO_MAX_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            task = asyncio.create_task(self._post(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _post(self, entries: List[PushEntry]):
+        try:
+            await self._request(entries)
+        except Exception as e:
+            logger.error(f"Error sending {len(entries)} push messages: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def _request(self, entries: List[PushEntry]) -> List[dict]:
+        """POST one batch; returns Expo's tickets, one per message."""
+        self.requests += 1
+        try:
+            response = await self._client().post(
+                self.push_url, json=[message for _, message in entries])
+            response.raise_for_status()
+        except Exception:
+            self.failed += len(entries)
+            raise
+        tickets = response.json().get("data", [])
+        self.sent += sum(1 for ticket in tickets if ticket.get("status") == "ok")
+        self.failed += sum(1 for ticket in tickets if ticket.get("status") == "error")
+        if self.receipts is not None:
+            self.receipts.track(entries, tickets)
+        return tickets
+
+    async def send(self, messages: List[dict], user_id: str) -> List[dict]:
+        """Send `user_id`'s messages right away; returns Expo's tickets."""
+        return await self._send_entries([(user_id, message) for message in messages])
+
+    async def _send_entries(self, entries: List[PushEntry]) -> List[dict]:
+        tickets = []
+        for start in range(0, len(entries), EXPO_MAX_BATCH):
+            chunk = entries[start:start + EXPO_MAX_BATCH]
+            if self._semaphore is None:
+                tickets.extend(await self._request(chunk))
+            else:
+                async with self._semaphore:
+                    tickets.extend(await self._request(chunk))
+        return tickets
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "coalescing": len(self._pending),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": len(self._inflight),
+            "coalesced": self.coalesced,
+            "requests": self.requests,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+
+class ReceiptWorker:
+    """Follows up on Expo push tickets and prunes dead device tokens.
+
+    Tickets accepted by Expo are remembered in memory (at most
+    `max_tickets`, oldest dropped first) and, once `delay` seconds old,
+    their receipts are fetched in batches every `interval` seconds. A ticket
+    or receipt reporting DeviceNotRegistered removes the token from the
+    recipient's `expo_tokens:{user_id}` set, so later pushes skip it.
+    """
+
+    def __init__(
+        self,
+        dispatcher: PushDispatcher,
+        receipts_url: str,
+        delay: float = 900.0,
+        interval: float = 60.0,
+        max_tickets: int = 50000,
+    ):
+        self.dispatcher = dispatcher
+        self.receipts_url = receipts_url
+        self.delay = delay
+        self.interval = interval
+        self.max_tickets = max_tickets
+        # ticket_id -> (user_id, token, sent_at); insertion order == send order
+        self.tickets: "OrderedDict[str, Tuple[str, str, float]]" = OrderedDict()
+        self._prunes: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.checked = 0
+        self.delivery_errors = 0
+        self.pruned = 0
+
+    def track(self, entries: List[PushEntry], tickets: List[dict]):
+        now = time.time()
+        for (user_id, message), ticket in zip(entries, tickets):
+            if ticket.get("status") == "ok" and ticket.get("id"):
+                self.tickets[ticket["id"]] = (user_id, message["to"], now)
+                while len(self.tickets) > self.max_tickets:
+                    self.tickets.popitem(last=False)
+            else:
+                self._on_error(user_id, message["to"], ticket)
+
+    def _on_error(self, user_id: str, token: str, result: dict):
+        self.delivery_errors += 1
+        error = (result.get("details") or {}).get("error")
+        logger.warning(
+            f"Push to user {user_id} failed: {error or result.get('message')}")
+        if error == "DeviceNotRegistered":
+            task = asyncio.create_task(self.prune(user_id, token))
+            self._prunes.add(task)
+            task.add_done_callback(self._prunes.discard)
+
+    async def prune(self, user_id: str, token: str):
+        try:
+            await redis.srem(f"expo_tokens:{user_id}", token)
+            self.dispatcher.context.invalidate_tokens(user_id)
+            self.pruned += 1
+            logger.info(f"Pruned unregistered push token of user {user_id}")
+        except Exception as e:
+            logger.error(f"Failed to prune push token of user {user_id}: {e}")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._prunes:
+            await asyncio.gather(*self._prunes, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Push receipt check failed: {e}")
+
+    async def check(self):
+        """Fetch receipts of tickets older than `delay`."""
+        now = time.time()
+        due = []
+        for ticket_id, (_, _, sent_at) in self.tickets.items():
+            if sent_at > now - self.delay:
+                break
+            due.append(ticket_id)
+        for start in range(0, len(due), EXPO_MAX_RECEIPT_IDS):
+            ids = due[start:start + EXPO_MAX_RECEIPT_IDS]
+            response = await self.dispatcher._client().post(
+                self.receipts_url, json={"ids": ids})
+            response.raise_for_status()
+            receipts = response.json().get("data", {})
+            for ticket_id in ids:
+                receipt = receipts.get(ticket_id)
+                # track() may have evicted the ticket while the request was out
+                if receipt is None:
+                    # Not ready yet; give up once Expo no longer keeps it
+                    ticket = self.tickets.get(ticket_id)
+                    if ticket and ticket[2] < now - EXPO_RECEIPT_TTL:
+                        self.tickets.pop(ticket_id, None)
+                    continue
+                ticket = self.tickets.pop(ticket_id, None)
+                if ticket is None:
+                    continue
+                user_id, token, _ = ticket
+                self.checked += 1
+                if receipt.get("status") == "error":
+                    self._on_error(user_id, token, receipt)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "awaiting_receipt": len(self.tickets),
+            "receipts_checked": self.checked,
+            "delivery_errors": self.delivery_errors,
+            "pruned": self.pruned,
+        }
+
+
 class Notifier:
-    def __init__(self): ...
+    def __init__(self, dispatcher: PushDispatcher):
+        self.dispatcher = dispatcher
 
     async def chat(
         self, user_id: str, sender_role: str, agent_id: str, raw_message: Any
@@ -25,8 +416,7 @@ class Notifier:
         try:
             message = raw_message.get("text")
             if sender_role == "user":
-                user = db.read_data(TableConfig.USER.value, user_id)
-                user_name = user.get("name") if user else "User"
+                user_name = await self.dispatcher.context.user_name(user_id)
                 sent_to_user_id = agent_id
 
                 data = {
@@ -42,56 +432,49 @@ class Notifier:
                 body=message,
                 data=data,
             )
-            return await self.push_notification_to_user(request)
+            await self.dispatcher.notify(request)
         except Exception as e:
             logger.error(f"Error sending push notification: {e}")
 
     async def push_notification_to_user(self, request: PushNotificationRequest):
         logger.debug(f"Sending push notification to user {request.user_id}")
-        redis_key = f"expo_tokens:{request.user_id}"
-        tokens = await redis.http.smembers(redis_key)
+        # Uncached on purpose: tells "no devices" apart from "no valid tokens"
+        tokens = await redis.smembers(f"expo_tokens:{request.user_id}")
 
         if not tokens:
             logger.info(f"No push tokens found for user {request.user_id}")
             return {"message": "No registered devices found for the user."}
 
-        messages = []
-        for token in tokens:
-            # Basic validation for Expo token format
-            if token.startswith("ExponentPushToken[") or token.startswith(
-                "ExpoPushToken["
-            ):
-                messages.append(
-                    {
-                        "to": token,
-                        "sound": "default",
-                        "title": request.title,
-                        "body": request.body,
-                        "data": request.data or {},
-                    }
-                )
-            else:
-                logger.warning(
-                    f"Invalid push token format for user {request.user_id}: {token}"
-                )
-
+        messages = self.dispatcher.messages_for(request, tokens)
         if not messages:
             raise HTTPException(
                 status_code=400, detail="No valid push tokens found for the user."
             )
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(EXPO_PUSH_URL, json=messages)
-                response.raise_for_status()
-                logger.debug(f"Push notification sent to user {request.user_id}")
-                return response.json()
-            except httpx.HTTPStatusError as e:
-                logger.error(f"Error sending push notification: {e.response.text}")
-                raise HTTPException(
-                    status_code=e.response.status_code,
-                    detail=f"Failed to send notification: {e.response.text}",
-                )
+        try:
+            tickets = await self.dispatcher.send(messages, request.user_id)
+            logger.debug(f"Push notification sent to user {request.user_id}")
+            return {"data": tickets}
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Error sending push notification: {e.response.text}")
+            raise HTTPException(
+                status_code=e.response.status_code,
+                detail=f"Failed to send notification: {e.response.text}",
+            )
 
 
-notifier = Notifier()
+notification_context = NotificationContext(ttl=ENV.NOTIFY_CONTEXT_TTL)
+push_dispatcher = PushDispatcher(
+    ENV.EXPO_PUSH_URL,
+    notification_context,
+    coalesce_window=ENV.PUSH_COALESCE_WINDOW,
+    max_concurrency=ENV.PUSH_MAX_CONCURRENCY,
+)
+receipt_worker = ReceiptWorker(
+    push_dispatcher,
+    ENV.EXPO_RECEIPTS_URL,
+    delay=ENV.EXPO_RECEIPT_DELAY,
+    interval=ENV.EXPO_RECEIPT_INTERVAL,
+)
+push_dispatcher.receipts = receipt_worker
+notifier = Notifier(push_dispatcher)
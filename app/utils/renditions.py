@@ -0,0 +1,133 @@
+import asyncio
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from google.api_core.exceptions import NotFound
+
+from app.core import storage
+from app.settings import ENV, logger
+from app.utils.helper import stream_response
+from app.utils.image import (
+    RENDITION_FORMATS,
+    process_upload,
+    rendition_widths,
+    supported_formats,
+)
+from app.utils.image_processor import image_processor
+
+RENDITION_WIDTHS = tuple(sorted(ENV.IMAGE_RENDITION_WIDTHS))
+# Configured formats this Pillow build can encode, most preferred first
+RENDITION_FORMATS_ENABLED = supported_formats(ENV.IMAGE_RENDITION_FORMATS)
+# `fmt` query value that always selects the uploaded blob
+ORIGINAL = "original"
+
+
+async def save_image(
+    image_bytes: bytes, kind: str, *, blob_name: str, content_type: str
+) -> str:
+    """Process an upload into its primary blob plus renditions and store them.
+
+    `kind` is "png", "thumbnail" or "compressed" (see
+    app.utils.image.process_upload). The image is decoded once on the image
+    workers; renditions are best effort, since reads fall back to the
+    primary blob when one is missing. Oversized uploads become 413 and
+    upload errors 500.
+    """
+    if len(image_bytes) > ENV.IMAGE_MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image is too large, at most {ENV.IMAGE_MAX_UPLOAD_BYTES} bytes allowed",
+        )
+    primary, renditions, timings = await image_processor.run(
+        process_upload,
+        image_bytes,
+        kind,
+        RENDITION_WIDTHS,
+        RENDITION_FORMATS_ENABLED,
+        ENV.IMAGE_RENDITION_QUALITY,
+        ENV.IMAGE_MAX_PIXELS,
+        ENV.IMAGE_MAX_DIMENSION,
+    )
+    image_processor.record_stages(timings)
+    logger.debug(
+        f"Processed '{blob_name}' ({len(image_bytes)} bytes): "
+        + ", ".join(f"{stage} {ms:.1f}ms" for stage, ms in timings.items()))
+    try:
+        public_url = await asyncio.to_thread(
+            storage.upload_bytes,
+            primary,
+            bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
+            blob_name=blob_name,
+            content_type=content_type,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to upload image: {e}")
+    try:
+        await asyncio.to_thread(
+            storage.upload_renditions,
+            renditions,
+            bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
+            blob_name=blob_name,
+        )
+    except Exception as e:
+        logger.error(f"Failed to upload renditions of '{blob_name}': {e}")
+    return public_url
+
+
+def choose_rendition(
+    kind: str, accept: Optional[str], width: Optional[int] = None, fmt: Optional[str] = None
+) -> Optional[Tuple[int, str]]:
+    """Pick the (width, format) rendition to serve, or None for the original.
+
+    `kind` is the kind the image was uploaded as (see save_image). An
+    explicit `fmt` wins; otherwise the most preferred format listed in the
+    `Accept` header is used. The width is the smallest rendition at least
+    `width` px wide; without `width` it is the largest stored for that kind,
+    which has the primary blob's size (see rendition_widths).
+    """
+    widths = rendition_widths(kind, RENDITION_WIDTHS, ENV.IMAGE_MAX_DIMENSION)
+    if not widths or fmt == ORIGINAL:
+        return None
+    if fmt is None:
+        accept = (accept or "").lower()
+        fmt = next(
+            (f for f in RENDITION_FORMATS_ENABLED if RENDITION_FORMATS[f][1] in accept), None)
+    if fmt not in RENDITION_FORMATS_ENABLED:
+        return None
+    if width is None:
+        return widths[-1], fmt
+    return next((w for w in widths if w >= width), widths[-1]), fmt
+
+
+def image_response(
+    blob_name: str,
+    media_type: Optional[str],
+    kind: str,
+    accept: Optional[str] = None,
+    width: Optional[int] = None,
+    fmt: Optional[str] = None,
+    range_header: Optional[str] = None,
+    if_range: Optional[str] = None,
+) -> StreamingResponse:
+    """Stream the negotiated rendition of `blob_name` (uploaded as `kind`),
+    else the blob itself.
+
+    Byte ranges are honored (see stream_response). Raises NotFound when the
+    original blob doesn't exist.
+    """
+    headers = {"Vary": "Accept"}
+    choice = choose_rendition(kind, accept, width, fmt) if (media_type or "").startswith("image/") else None
+    if choice is not None:
+        try:
+            stream = storage.open_stream(
+                bucket_name=ENV.GOOGLE_STORAGE_BUCKET,
+                blob_name=storage.rendition_name(blob_name, *choice),
+            )
+            return stream_response(
+                stream, range_header, if_range, RENDITION_FORMATS[choice[1]][1], headers)
+        except NotFound:
+            # Uploaded before renditions existed (or their upload failed)
+            pass
+    stream = storage.open_stream(bucket_name=ENV.GOOGLE_STORAGE_BUCKET, blob_name=blob_name)
+    return stream_response(stream, range_header, if_range, media_type, headers)
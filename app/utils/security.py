@@ -1,30 +1,93 @@
+import asyncio
 import binascii
 import hashlib
+import hmac
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from fastapi import HTTPException, Header
 import jwt
 
 from app.core import firebase
+from app.core.cache import TTLCache
 from app.settings import ENV, logger
 
+# user id of recently verified tokens, keyed by (source, sha256 of token);
+# entries never outlive the token's own `exp`
+token_cache = TTLCache(max_entries=ENV.AUTH_CACHE_MAX_ENTRIES, default_ttl=ENV.AUTH_CACHE_TTL)
 
-def hash_password(password: str) -> str:
-    """Hash a password using PBKDF2_HMAC and return salt$hash hex string."""
+
+PASSWORD_ALGORITHM = "pbkdf2_sha256"
+# Cost of hashes stored as plain salt$hash, before the format carried it
+LEGACY_PASSWORD_ITERATIONS = 100000
+
+# hashlib.pbkdf2_hmac releases the GIL, so threads hash in parallel without
+# the pickling overhead of a process pool; the pool size bounds CPU use.
+password_pool = ThreadPoolExecutor(
+    max_workers=ENV.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+
+
+def hash_password(password: str, iterations: Optional[int] = None) -> str:
+    """Hash a password using PBKDF2_HMAC.
+
+    Returns "pbkdf2_sha256$iterations$salt$hash" (hex salt and hash).
+    """
+    iterations = iterations or ENV.PASSWORD_HASH_ITERATIONS
     salt = os.urandom(16)
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 100000)
-    return binascii.hexlify(salt).decode() + "$" + binascii.hexlify(dk).decode()
+    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return "$".join(
+        [PASSWORD_ALGORITHM, str(iterations), binascii.hexlify(salt).decode(),
+         binascii.hexlify(dk).decode()]
+    )
+
+
+def _parse_password_hash(stored: str):
+    """(iterations, salt, hash) of a current or legacy salt$hash string."""
+    parts = stored.split("$")
+    if len(parts) == 2:
+        salt_hex, hash_hex = parts
+        iterations = LEGACY_PASSWORD_ITERATIONS
+    else:
+        algorithm, iterations, salt_hex, hash_hex = parts
+        if algorithm != PASSWORD_ALGORITHM:
+            raise ValueError(f"Unsupported password hash algorithm '{algorithm}'")
+        iterations = int(iterations)
+    return iterations, binascii.unhexlify(salt_hex), binascii.unhexlify(hash_hex)
 
 
 def verify_password(stored: str, provided: str) -> bool:
     try:
-        salt_hex, hash_hex = stored.split("$")
-        salt = binascii.unhexlify(salt_hex)
-        dk = hashlib.pbkdf2_hmac("sha256", provided.encode("utf-8"), salt, 100000)
-        return binascii.hexlify(dk).decode() == hash_hex
+        iterations, salt, expected = _parse_password_hash(stored)
+        dk = hashlib.pbkdf2_hmac("sha256", provided.encode("utf-8"), salt, iterations)
+        return hmac.compare_digest(dk, expected)
     except Exception:
         return False
 
 
+def password_needs_rehash(stored: str) -> bool:
+    """True for legacy hashes and hashes made with a different cost."""
+    try:
+        iterations, _, _ = _parse_password_hash(stored)
+    except Exception:
+        return False
+    return not stored.startswith(PASSWORD_ALGORITHM + "$") or (
+        iterations != ENV.PASSWORD_HASH_ITERATIONS
+    )
+
+
+async def hash_password_async(password: str) -> str:
+    """hash_password on the password pool, off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_pool, hash_password, password)
+
+
+async def verify_password_async(stored: str, provided: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_pool, verify_password, stored, provided)
+
+
 def verify_jwt_token(token, secret_key):
     try:
         payload = jwt.decode(token, secret_key, algorithms=["HS256"])
@@ -45,12 +108,29 @@ def get_user_id(
 
     token = authorization.split(" ")[1]
 
+    key = (token_source, hashlib.sha256(token.encode("utf-8")).hexdigest())
+    user_id = token_cache.get(key)
+    if user_id is not None:
+        return user_id
+
     try:
         if token_source == "firebase":
-            return firebase.verify_token(token).get("uid")
+            payload = firebase.verify_token(token)
+            user_id = payload.get("uid")
         else:
             payload = jwt.decode(token, ENV.SECRET_KEY, algorithms=["HS256"])
-        return payload.get("id")
+            user_id = payload.get("id")
     except Exception as e:
         logger.error(f"Error verifying token: {str(e)}")
         return None
+    remember_token(key, user_id, payload.get("exp"))
+    return user_id
+
+
+def remember_token(key: tuple, user_id: Optional[str], exp: Optional[float]):
+    if not user_id:
+        return
+    ttl = ENV.AUTH_CACHE_TTL
+    if exp is not None:
+        ttl = min(ttl, float(exp) - time.time())
+    token_cache.set(key, user_id, ttl=ttl)
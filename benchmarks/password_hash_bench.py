@@ -0,0 +1,55 @@
+"""Measure password verification throughput (logins/second).
+
+Usage: python benchmarks/password_hash_bench.py [logins] [iterations ...]
+
+For each PBKDF2 cost (default: PASSWORD_HASH_ITERATIONS) it verifies
+`logins` passwords on one thread, then through the password pool used by
+the login route, and prints logins/second overall and per worker.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.settings import ENV  # noqa: E402
+from app.utils.security import (  # noqa: E402
+    hash_password,
+    password_pool,
+    verify_password,
+    verify_password_async,
+)
+
+
+def single_thread(stored: str, logins: int) -> float:
+    start = time.perf_counter()
+    for _ in range(logins):
+        verify_password(stored, "bench-password")
+    return logins / (time.perf_counter() - start)
+
+
+async def pooled(stored: str, logins: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(verify_password_async(stored, "bench-password") for _ in range(logins)))
+    return logins / (time.perf_counter() - start)
+
+
+def main(logins: int, costs):
+    workers = password_pool._max_workers
+    print(f"{logins} logins per run, {workers} pool workers, {os.cpu_count()} CPUs")
+    print(f"{'iterations':>12}{'1 thread/s':>14}{'pool/s':>12}{'pool/s/worker':>16}")
+    for iterations in costs:
+        stored = hash_password("bench-password", iterations)
+        serial = single_thread(stored, max(1, logins // workers))
+        parallel = asyncio.run(pooled(stored, logins))
+        print(f"{iterations:>12}{serial:>14.1f}{parallel:>12.1f}{parallel / workers:>16.1f}")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(args[0] if args else 200, args[1:] or [ENV.PASSWORD_HASH_ITERATIONS])
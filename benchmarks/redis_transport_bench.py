@@ -0,0 +1,92 @@
+"""Compare Redis command latency over the pooled RESP connection vs Upstash HTTP.
+
+Usage: python benchmarks/redis_transport_bench.py [iterations] [concurrency]
+
+Runs the hot commands of the app (push-token sets, presence hashes and the
+presence pipeline) against scratch keys on both transports and prints
+per-command latency percentiles. Uses the Redis settings from .env.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.upstash_redis import KV_TRANSPORTS, UnifiedRedisManager  # noqa: E402
+from app.settings import ENV  # noqa: E402
+
+
+def make_manager(transport: str) -> UnifiedRedisManager:
+    return UnifiedRedisManager(
+        http_url=ENV.REDIS_SERVER_URL,
+        http_token=ENV.REDIS_SERVER_ACCESS_TOKEN,
+        resp_host=ENV.REDIS_RESP_HOST,
+        resp_port=ENV.REDIS_RESP_PORT,
+        resp_password=ENV.REDIS_RESP_PASSWORD,
+        kv_transport=transport,
+        max_connections=ENV.REDIS_MAX_CONNECTIONS,
+    )
+
+
+async def timed(samples, call):
+    start = time.perf_counter()
+    await call()
+    samples.append((time.perf_counter() - start) * 1000)
+
+
+async def run(manager: UnifiedRedisManager, iterations: int, concurrency: int):
+    prefix = f"bench:{uuid.uuid4().hex[:8]}"
+    user_id, socket_id, instance_id = f"{prefix}:user", f"{prefix}:socket", prefix
+    operations = {
+        "sadd": lambda: manager.sadd(f"{prefix}:tokens", "ExponentPushToken[bench]"),
+        "smembers": lambda: manager.smembers(f"{prefix}:tokens"),
+        "presence add": lambda: manager.add_connected_user(user_id, socket_id, instance_id),
+        "presence lookup": lambda: manager.get_user_instances(user_id),
+        "presence refresh": lambda: manager.refresh_connected_users(
+            {socket_id: user_id}, instance_id),
+    }
+    results = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(samples, call):
+        async with semaphore:
+            await timed(samples, call)
+
+    try:
+        for name, call in operations.items():
+            await call()  # warm up connections
+            samples = []
+            await asyncio.gather(*(limited(samples, call) for _ in range(iterations)))
+            results[name] = samples
+    finally:
+        await manager.remove_connected_user(user_id, socket_id)
+        await manager.http.zrem(manager.PRESENCE_INSTANCES_KEY, instance_id)
+        await manager.http.delete(f"{prefix}:tokens")
+        await manager.close()
+    return results
+
+
+def report(transport: str, results):
+    print(f"\n{transport.upper()}")
+    print(f"{'command':<18}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, samples in results.items():
+        samples.sort()
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        print(f"{name:<18}{statistics.median(samples):>10.2f}{p95:>10.2f}"
+              f"{statistics.fmean(samples):>10.2f}")
+
+
+async def main(iterations: int, concurrency: int):
+    for transport in KV_TRANSPORTS:
+        report(transport, await run(make_manager(transport), iterations, concurrency))
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*(args + [200, 10][len(args):])))
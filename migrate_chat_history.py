@@ -0,0 +1,26 @@
+"""Move legacy ChatHistory.messages arrays into per-message subcollections.
+
+Usage: python migrate_chat_history.py [doc_id ...]
+Without arguments every conversation that still has an array is migrated.
+Safe to re-run: migrated messages get deterministic ids.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import asyncio
+import sys
+
+from app.utils.message_store import message_store
+
+
+async def main(doc_ids):
+    if not doc_ids:
+        return await message_store.migrate_all_legacy()
+    migrated = 0
+    for doc_id in doc_ids:
+        migrated += await message_store.migrate_legacy(doc_id)
+    return migrated
+
+
+if __name__ == "__main__":
+    print(f"Migrated {asyncio.run(main(sys.argv[1:]))} messages")
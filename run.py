@@ -1,11 +1,11 @@
-from dotenv import load_dotenv
-load_dotenv()
-
-from app.main import initialize_application
-
-app = initialize_application()
-
-
 if __name__ =="__main__":
+    # Build the app only here: image workers are spawned and re-import this
+    # module as __mp_main__, and must not create their own clients
+    from dotenv import load_dotenv
+    load_dotenv()
+
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    from app.main import initialize_application
+
+    app = initialize_application()
+    uvicorn.run(app, host="0.0.0.0", port=8080)